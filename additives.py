@@ -0,0 +1,174 @@
+import re
+from bisect import bisect_left
+
+
+# ── Additive table and ingredient matcher ──────────────────────────────────────
+# The model only transcribes the ingredients list; flagging is done here so the
+# same list always gets the same flags and the table can change without touching
+# the prompt. E-numbers are matched however the label writes them: E211, E-211,
+# INS 211 or a bare "(211)" after the class name, as Indian labels usually do.
+
+# (display name, kind, aliases). E-number aliases are written as 'e<number>'.
+# Aliases match whole words only, so plurals labels use are listed as aliases.
+ADDITIVES = [
+    # Artificial colours
+    ('Tartrazine (E102)', 'colour', ('e102', 'tartrazine', 'fd&c yellow 5')),
+    ('Quinoline Yellow (E104)', 'colour', ('e104', 'quinoline yellow')),
+    ('Sunset Yellow FCF (E110)', 'colour', ('e110', 'sunset yellow', 'fd&c yellow 6')),
+    ('Carmoisine (E122)', 'colour', ('e122', 'carmoisine', 'azorubine')),
+    ('Ponceau 4R (E124)', 'colour', ('e124', 'ponceau 4r', 'ponceau')),
+    ('Allura Red (E129)', 'colour', ('e129', 'allura red', 'fd&c red 40')),
+    ('Brilliant Blue FCF (E133)', 'colour', ('e133', 'brilliant blue', 'fd&c blue 1')),
+    ('Green S (E142)', 'colour', ('e142', 'green s')),
+    ('Brilliant Black (E151)', 'colour', ('e151', 'brilliant black')),
+    ('Brown HT (E155)', 'colour', ('e155', 'brown ht')),
+    # Preservatives
+    ('Sodium Benzoate (E211)', 'preservative', ('e211', 'sodium benzoate')),
+    ('Potassium Benzoate (E212)', 'preservative', ('e212', 'potassium benzoate')),
+    ('Calcium Benzoate (E213)', 'preservative', ('e213', 'calcium benzoate')),
+    ('Sulphur Dioxide (E220)', 'preservative', ('e220', 'sulphur dioxide', 'sulfur dioxide')),
+    ('Sodium Sulphite (E221)', 'preservative', ('e221', 'sodium sulphite', 'sodium sulfite')),
+    ('Sodium Bisulphite (E222)', 'preservative', ('e222', 'sodium bisulphite', 'sodium bisulfite')),
+    ('Sodium Metabisulphite (E223)', 'preservative', ('e223', 'sodium metabisulphite', 'sodium metabisulfite')),
+    ('Potassium Metabisulphite (E224)', 'preservative',
+     ('e224', 'potassium metabisulphite', 'potassium metabisulfite')),
+    ('Potassium Nitrite (E249)', 'preservative', ('e249', 'potassium nitrite')),
+    ('Sodium Nitrite (E250)', 'preservative', ('e250', 'sodium nitrite')),
+    ('Sodium Nitrate (E251)', 'preservative', ('e251', 'sodium nitrate')),
+    ('Potassium Nitrate (E252)', 'preservative', ('e252', 'potassium nitrate')),
+    # Artificial sweeteners
+    ('Acesulfame-K (E950)', 'sweetener', ('e950', 'acesulfame k', 'acesulfame potassium', 'acesulfame')),
+    ('Aspartame (E951)', 'sweetener', ('e951', 'aspartame')),
+    ('Cyclamate (E952)', 'sweetener', ('e952', 'cyclamate', 'sodium cyclamate')),
+    ('Saccharin (E954)', 'sweetener', ('e954', 'saccharin', 'sodium saccharin')),
+    ('Sucralose (E955)', 'sweetener', ('e955', 'sucralose')),
+    # Trans fats
+    ('Partially hydrogenated oil', 'trans_fat', ('partially hydrogenated',)),
+    ('Hydrogenated oil', 'trans_fat', ('hydrogenated vegetable oil', 'hydrogenated vegetable oils',
+                                        'hydrogenated oil', 'hydrogenated oils', 'hydrogenated fat',
+                                        'hydrogenated fats', 'hydrogenated vegetable fat',
+                                        'hydrogenated vegetable fats')),
+    ('Vanaspati', 'trans_fat', ('vanaspati',)),
+    # Other
+    ('High-fructose corn syrup', 'other', ('high fructose corn syrup', 'hfcs', 'glucose fructose syrup')),
+    ('MSG (E621)', 'other', ('e621', 'monosodium glutamate', 'msg')),
+    ('TBHQ (E319)', 'other', ('e319', 'tbhq', 'tertiary butylhydroquinone', 'tert butylhydroquinone')),
+    ('BHA (E320)', 'other', ('e320', 'bha', 'butylated hydroxyanisole')),
+    ('BHT (E321)', 'other', ('e321', 'bht', 'butylated hydroxytoluene')),
+    ('Carrageenan (E407)', 'other', ('e407', 'carrageenan')),
+    # FSSAI (India) banned / restricted — reported as fssai_flags, not bad_ingredients
+    ('Potassium Bromate (E924)', 'fssai', ('e924', 'potassium bromate')),
+    ('Rhodamine B', 'fssai', ('rhodamine b', 'rhodamine')),
+    ('Metanil Yellow', 'fssai', ('metanil yellow',)),
+    ('Argemone Oil', 'fssai', ('argemone oil', 'argemone')),
+    ('Brominated Vegetable Oil', 'fssai', ('brominated vegetable oil', 'brominated vegetable oils', 'bvo')),
+    ('Coal tar dye', 'fssai', ('coal tar',)),
+]
+
+# Claims of absence. "non-" only negates the word it is attached to
+# ("non-hydrogenated"); "no", "without" or "free from" negate the rest of their
+# clause ("contains no added preservatives or MSG"), and "free" / "not added"
+# negate only the word right before them ("MSG-free", "MSG not added"), not
+# everything earlier in the clause ("sweetener (sucralose) not added sugar"). A
+# clause ends at the next comma, semicolon, colon, full stop or spaced dash.
+NEGATION_PREFIXES = ('non ',)
+LEADING_NEGATIONS = re.compile(r'\b(?:no|not|nil|without|free (?:from|of))\b')
+TRAILING_NEGATION = re.compile(r' (?:free|not added)\b')
+CLAUSE_BREAKS = re.compile(r'[,;:.]')
+SPACED_DASHES = re.compile(r'\s+[-\u2013\u2014]+\s+')
+
+
+class AhoCorasick:
+    """Multi-pattern matcher: one pass over the text finds every occurrence of every pattern."""
+
+    def __init__(self, patterns):
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        for pattern, value in patterns:
+            node = 0
+            for ch in pattern:
+                if ch not in self._goto[node]:
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                    self._goto[node][ch] = len(self._goto) - 1
+                node = self._goto[node][ch]
+            self._out[node].append((len(pattern), value))
+
+        # Breadth-first: each node's failure link is the longest proper suffix in the trie
+        queue = list(self._goto[0].values())
+        for node in queue:
+            for ch, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(ch, 0)
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+
+    def find(self, text):
+        """Yield (start, end, value) for every pattern occurrence, in order of end position."""
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(ch, 0)
+            for length, value in self._out[node]:
+                yield i + 1 - length, i + 1, value
+
+
+def normalize_ingredients(text):
+    """Lower-case ingredient text with every E-number spelling rewritten as 'e<number>'.
+
+    A dash between spaces separates clauses, so it becomes a comma; any other
+    hyphen joins words ("msg-free") and becomes a space.
+    """
+    text = SPACED_DASHES.sub(', ', str(text or ''))
+    text = ' '.join(text.lower().replace('-', ' ').split())
+    text = re.sub(r'\b(?:e|ins)\s?\.?\s?(\d{3,4}[a-z]?)\b', r'e\1', text)
+    # "Colours (102, 110)", "preservative (211)" — bare numbers in brackets are INS numbers
+    return re.sub(r'\(([\d\s,&a-z]*?\d{3}[\d\s,&a-z]*)\)',
+                  lambda m: '(' + re.sub(r'\b(\d{3,4}[a-z]?)\b', r'e\1', m.group(1)) + ')', text)
+
+
+class AdditiveMatcher:
+    """Flags the additives in an ingredients list using the ADDITIVES table."""
+
+    def __init__(self, table=ADDITIVES):
+        self._matcher = AhoCorasick((alias, (name, kind)) for name, kind, aliases in table for alias in aliases)
+
+    def match(self, text):
+        """Return (bad_ingredients, fssai_flags) found in `text`, in label order, without duplicates."""
+        text = normalize_ingredients(text)
+        breaks = [m.start() for m in CLAUSE_BREAKS.finditer(text)]
+        hits = []
+        for start, end, found in self._matcher.find(text):
+            # Whole words only: 'msg' must not match inside 'msgs', nor 'bha' inside 'bhaji'
+            if (start and text[start - 1].isalnum()) or (end < len(text) and text[end].isalnum()):
+                continue
+            if self._negated(text, start, end, breaks):
+                continue
+            hits.append((start, -(end - start), end, found))
+
+        # Where aliases overlap ("partially hydrogenated oil" / "hydrogenated oil") the longest wins
+        bad, fssai, taken_until = [], [], 0
+        for start, _, end, (name, kind) in sorted(hits):
+            if start < taken_until:
+                continue
+            taken_until = end
+            flags = fssai if kind == 'fssai' else bad
+            if name not in flags:
+                flags.append(name)
+        return bad, fssai
+
+    @staticmethod
+    def _negated(text, start, end, breaks):
+        """True if the match at text[start:end] is part of a claim that it is absent."""
+        if text[:start].endswith(NEGATION_PREFIXES):
+            return True
+        i = bisect_left(breaks, start)
+        clause_start = breaks[i - 1] + 1 if i else 0
+        clause_end = breaks[i] if i < len(breaks) else len(text)
+        return bool(LEADING_NEGATIONS.search(text, clause_start, start)
+                    or TRAILING_NEGATION.match(text, end, clause_end))
@@ -0,0 +1,122 @@
+import copy
+import hashlib
+import io
+import threading
+import time
+from collections import OrderedDict
+
+from PIL import Image
+
+
+# ── Image fingerprints ─────────────────────────────────────────────────────────
+
+def content_hash(image_data):
+    """Exact fingerprint of the uploaded bytes."""
+    return hashlib.sha256(image_data).hexdigest()
+
+
+def perceptual_hash(image_data, size=16):
+    """Difference hash (dHash) of the image. Returns an int, or None if Pillow can't read it.
+
+    Near-identical re-shots of the same label differ in a handful of bits — but so
+    do two flavours of one product printed on the same layout, since the hash
+    can't see the digits. A close match only says "probably the same photo".
+    """
+    try:
+        with Image.open(io.BytesIO(image_data)) as img:
+            img.draft('L', (size * 8, size * 8))
+            pixels = list(img.convert('L').resize((size + 1, size), Image.LANCZOS).getdata())
+    except Exception:
+        return None
+    bits = 0
+    for row in range(size):
+        offset = row * (size + 1)
+        for col in range(size):
+            bits = (bits << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return bits
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+# ── Analysis cache ─────────────────────────────────────────────────────────────
+
+class AnalysisCache:
+    """Thread-safe LRU + TTL cache of label analysis results keyed by image content.
+
+    Lookups try the exact content hash first. Only for an `owner` (the
+    uploader's session) do they fall back to the closest perceptual hash within
+    `max_distance` bits, and only among that owner's own uploads: a near match
+    can be a different product, so one user's result is never served to
+    another on similarity alone.
+    """
+
+    def __init__(self, max_entries=512, ttl=24 * 3600, max_distance=10):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self._entries = OrderedDict()   # content hash -> (expires_at, phash, owner, result)
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        stale = [k for k, entry in self._entries.items() if entry[0] <= now]
+        for k in stale:
+            del self._entries[k]
+
+    def get(self, image_data, owner=None):
+        """Return a copy of the cached result for this image, or None on a miss."""
+        if self.max_entries <= 0:
+            return None
+        key = content_hash(image_data)
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return copy.deepcopy(entry[3])
+            if owner is None or self.max_distance < 0 or not self._entries:
+                return None
+
+        # Decode outside the lock — it is the slow part of a miss
+        phash = perceptual_hash(image_data)
+        with self._lock:
+            entry, key = self._nearest(phash, owner)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return copy.deepcopy(entry[3])
+
+    def _nearest(self, phash, owner):
+        if phash is None:
+            return None, None
+        best, best_key, best_dist = None, None, self.max_distance + 1
+        for k, entry in self._entries.items():
+            if entry[1] is None or entry[2] != owner:
+                continue
+            dist = hamming_distance(phash, entry[1])
+            if dist < best_dist:
+                best, best_key, best_dist = entry, k, dist
+        return best, best_key
+
+    def put(self, image_data, result, owner=None):
+        """Store a copy of the analysis result for this image, uploaded by `owner`."""
+        if self.max_entries <= 0 or not result:
+            return
+        key = content_hash(image_data)
+        # Without an owner the entry can only ever be an exact hit
+        phash = perceptual_hash(image_data) if owner is not None and self.max_distance >= 0 else None
+        result = copy.deepcopy(result)
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, phash, owner, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
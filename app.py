@@ -1,13 +1,36 @@
-from flask import Flask, render_template, request, jsonify, session
+from flask import Flask, Response, g, render_template, request, jsonify, session, stream_with_context
 import os
 import base64
 import json
 import re
-import uuid
+import shutil
 import tempfile
+import uuid
+import zipfile
+from collections import deque
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait
+import click
+from flask.cli import AppGroup
 from googlesearch import search
 import google.generativeai as genai
 from dotenv import load_dotenv
+from werkzeug.exceptions import RequestEntityTooLarge
+from analysis_cache import AnalysisCache, content_hash
+from image_store import create_image_store
+from ttl_cache import TTLCache, normalize_key
+from hsr import score_product
+from additives import AdditiveMatcher
+from schemas import (ResponseParser, HSR_SCHEMA, IDENTIFY_SCHEMA, SAME_BRAND_SCHEMA,
+                     ALT_BRAND_SCHEMA)
+from image_prep import prepare_image
+from quality_gate import QualityGate
+from rate_limit import (AdmissionController, RateLimited, PRIORITY_INTERACTIVE,
+                        PRIORITY_BACKGROUND, PRIORITY_BULK)
+from resilience import CircuitBreaker, ResilientCaller, UpstreamUnavailable
+from batch_store import BatchStore
+from catalogue import ProductCatalogue
+import metrics
 
 load_dotenv()
 
@@ -15,14 +38,125 @@ app = Flask(__name__)
 app.secret_key = os.getenv('SECRET_KEY', os.urandom(24))
 app.config['UPLOAD_FOLDER'] = 'static/uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
-# Temp dir for per-user image storage
-TEMP_DIR = tempfile.mkdtemp(prefix='baagundhaaa_')
+# Per-session image storage — SQLite by default so every gunicorn worker sees the same images
+IMAGE_STORE = create_image_store(
+    backend=os.getenv('IMAGE_STORE', 'sqlite'),
+    path=os.getenv('IMAGE_STORE_PATH'),
+    ttl=int(os.getenv('IMAGE_STORE_TTL', 3600)),
+    max_bytes=int(os.getenv('IMAGE_STORE_MAX_BYTES', 256 * 1024 * 1024)),
+)
+# Requests one process keeps in flight under the gunicorn worker profile
+# (gunicorn.conf.py reads the same variables). The pools below default to a
+# size that keeps up with it; under gevent their threads are greenlets
+WORKER_CLASS = os.getenv('WORKER_CLASS', 'gthread')
+REQUEST_CONCURRENCY = {'gevent': int(os.getenv('WORKER_CONNECTIONS', 500)),
+                       'sync': 1}.get(WORKER_CLASS, int(os.getenv('THREADS', 32)))
+# Shared pool for the concurrent search + recommendation stages of /process,
+# which runs two or three of them per request
+PROCESS_POOL = ThreadPoolExecutor(max_workers=int(os.getenv('PROCESS_WORKERS', max(8, 2 * REQUEST_CONCURRENCY))),
+                                  thread_name_prefix='process')
+# Uploads are shrunk and normalised before they are stored or sent to the model
+IMAGE_MAX_EDGE = int(os.getenv('IMAGE_MAX_EDGE', 1600))
+IMAGE_FORMAT = os.getenv('IMAGE_FORMAT', 'JPEG')
+IMAGE_QUALITY = int(os.getenv('IMAGE_QUALITY', 85))
+IMAGE_GRAYSCALE = os.getenv('IMAGE_GRAYSCALE', 'auto')  # auto | always | never
+# Largest single photo accepted. Pages shrink photos to IMAGE_MAX_EDGE before
+# uploading, so real captures are far below this
+UPLOAD_MAX_BYTES = int(os.getenv('UPLOAD_MAX_BYTES', 10 * 1024 * 1024))
+UPLOAD_TOO_LARGE = f"This photo is too large (over {UPLOAD_MAX_BYTES // (1024 * 1024)} MB). Please try a smaller one."
+# Blurred, dark or tiny photos are turned away before they cost a model call
+QUALITY_GATE = QualityGate(
+    enabled=os.getenv('QUALITY_GATE', '1') != '0',
+    min_sharpness=float(os.getenv('QUALITY_MIN_SHARPNESS', 15)),
+    min_brightness=float(os.getenv('QUALITY_MIN_BRIGHTNESS', 35)),
+    max_brightness=float(os.getenv('QUALITY_MAX_BRIGHTNESS', 235)),
+    min_contrast=float(os.getenv('QUALITY_MIN_CONTRAST', 8)),
+    min_edge=int(os.getenv('QUALITY_MIN_EDGE', 240)),
+    glare_contrast=float(os.getenv('QUALITY_GLARE_CONTRAST', 20)),
+)
+# One Gemini quota shared by every worker on the box: interactive scans jump the
+# queue ahead of /process, and callers that can't be served in time get a 429
+ADMISSION = AdmissionController(
+    path=os.getenv('RATE_LIMIT_PATH'),
+    rate=float(os.getenv('GEMINI_RPM', 600)) / 60,
+    burst=int(os.getenv('GEMINI_BURST', 20)),
+    max_queue=int(os.getenv('ADMISSION_MAX_QUEUE', 200)),
+)
+ADMISSION_MAX_WAIT = {
+    PRIORITY_INTERACTIVE: float(os.getenv('ADMISSION_WAIT_INTERACTIVE', 8)),
+    PRIORITY_BACKGROUND: float(os.getenv('ADMISSION_WAIT_BACKGROUND', 15)),
+    PRIORITY_BULK: float(os.getenv('ADMISSION_WAIT_BULK', 60)),
+}
+# Every model call gets a deadline, jittered retries on transient errors, an
+# optional hedged duplicate past p95 latency, and a breaker that fails fast while
+# Gemini is degraded
+MODEL_CALLER = ResilientCaller(
+    deadline=float(os.getenv('MODEL_DEADLINE', 45)),
+    retries=int(os.getenv('MODEL_RETRIES', 2)),
+    backoff=float(os.getenv('MODEL_BACKOFF', 0.5)),
+    hedge=os.getenv('MODEL_HEDGE', '0') == '1',
+    breaker=CircuitBreaker(threshold=int(os.getenv('BREAKER_THRESHOLD', 5)),
+                           reset_timeout=float(os.getenv('BREAKER_RESET', 30))),
+    # Every Gemini call runs on this pool: room for each request's call plus a hedge
+    max_workers=int(os.getenv('MODEL_WORKERS', max(8, 2 * REQUEST_CONCURRENCY))),
+)
+# Errors that mean "come back later" rather than "this request is broken"
+BACKPRESSURE_ERRORS = (RateLimited, UpstreamUnavailable)
+# Bounded pool for label analyses that run side by side (e.g. comparing a shelf of products)
+ANALYSIS_POOL = ThreadPoolExecutor(max_workers=int(os.getenv('ANALYSIS_WORKERS', max(16, REQUEST_CONCURRENCY // 2))),
+                                   thread_name_prefix='analysis')
+COMPARE_MAX_PRODUCTS = int(os.getenv('COMPARE_MAX_PRODUCTS', 12))
+# Catalogue onboarding: many labels per request, a few analysed at a time per batch
+BATCH_STORE = BatchStore(path=os.getenv('BATCH_STORE_PATH'), ttl=int(os.getenv('BATCH_TTL', 7 * 24 * 3600)))
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', 4))
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', 1000))
+BATCH_MAX_BYTES = int(os.getenv('BATCH_MAX_BYTES', 512 * 1024 * 1024))
+# Search results and recommendations depend only on (brand, product), so popular
+# products are answered from cache and stay under the search provider's rate limits
+CACHE_PATH = os.getenv('CACHE_PATH')  # optional SQLite file to persist across restarts
+SEARCH_CACHE = TTLCache(
+    'search',
+    max_entries=int(os.getenv('SEARCH_CACHE_SIZE', 2048)),
+    ttl=int(os.getenv('SEARCH_CACHE_TTL', 24 * 3600)),
+    stale_ttl=int(os.getenv('CACHE_STALE_TTL', 6 * 3600)),
+    path=CACHE_PATH,
+    on_lookup=metrics.record_cache,
+)
+RECOMMENDATION_CACHE = TTLCache(
+    'recommendation',
+    max_entries=int(os.getenv('RECOMMENDATION_CACHE_SIZE', 2048)),
+    ttl=int(os.getenv('RECOMMENDATION_CACHE_TTL', 24 * 3600)),
+    stale_ttl=int(os.getenv('CACHE_STALE_TTL', 6 * 3600)),
+    path=CACHE_PATH,
+    on_lookup=metrics.record_cache,
+)
+# Repeat scans of the same label skip the model call entirely
+ANALYSIS_CACHE = AnalysisCache(
+    max_entries=int(os.getenv('ANALYSIS_CACHE_SIZE', 512)),
+    ttl=int(os.getenv('ANALYSIS_CACHE_TTL', 24 * 3600)),
+    max_distance=int(os.getenv('ANALYSIS_CACHE_MAX_DISTANCE', 10)),
+)
+ADDITIVE_MATCHER = AdditiveMatcher()
+RESPONSE_PARSER = ResponseParser()
+MODEL_SCHEMAS = {'hsr': HSR_SCHEMA, 'identify': IDENTIFY_SCHEMA,
+                 'same_brand': SAME_BRAND_SCHEMA, 'alt_brand': ALT_BRAND_SCHEMA}
+# One JSON line per request with its stage timings; PROFILE_SAMPLE_RATE > 0 needs pyinstrument
+REQUEST_LOG = os.getenv('REQUEST_LOG', '1') == '1'
+PROFILER = metrics.RequestProfiler(
+    sample_rate=float(os.getenv('PROFILE_SAMPLE_RATE', 0)),
+    min_seconds=float(os.getenv('PROFILE_MIN_SECONDS', 1)),
+    directory=os.getenv('PROFILE_DIR'),
+)
+# Products seen before (any photo of them) — answers known barcodes and stores alternatives
+CATALOGUE = ProductCatalogue(path=os.getenv('CATALOGUE_PATH'))
 
 api_key = os.getenv("GEMINI_API_KEY")
 if not api_key:
     print("CRITICAL: GEMINI_API_KEY not found. Check your .env file.")
 else:
-    genai.configure(api_key=api_key)
+    # 'rest' under gevent workers (set by gunicorn.conf.py) so model calls yield instead of blocking
+    transport = os.getenv('GEMINI_TRANSPORT')
+    genai.configure(api_key=api_key, **({'transport': transport} if transport else {}))
 
 model = genai.GenerativeModel('gemini-2.5-flash')
 
@@ -30,7 +164,7 @@ if not os.path.exists(app.config['UPLOAD_FOLDER']):
     os.makedirs(app.config['UPLOAD_FOLDER'])
 
 
-# ── Full HSR scoring prompt ────────────────────────────────────────────────────
+# ── HSR label extraction prompt ───────────────────────────────────────────────
 HSR_ANALYSIS_PROMPT = """
 You are a certified food label analyst. Carefully examine this food product label image.
 
@@ -47,8 +181,13 @@ First, identify the product category from the label. Choose ONE from:
 - "fruit_vegetable" (packaged fruits, vegetable products, fruit purees)
 - "other" (anything that does not fit above)
 
+Also read the BRAND name exactly as printed on the pack, and the specific PRODUCT TYPE
+in 2-4 words (e.g. "instant noodles", "potato chips", "cream biscuits", "mango juice").
+If a barcode is visible, read the digits printed under it.
+
 STEP 2 — READ NUTRITION VALUES
-Extract values shown on the label per 100g (solids) or per 100ml (beverages/liquids):
+Extract values shown on the label per 100g (solids) or per 100ml (beverages/liquids).
+Report numbers only — do NOT calculate any score or rating, that is done separately.
 - Energy (kJ) — if only kcal shown, multiply by 4.18
 - Saturated Fat (g)
 - Total Sugars (g)
@@ -56,75 +195,22 @@ Extract values shown on the label per 100g (solids) or per 100ml (beverages/liqu
 - Protein (g) — use 0 if not listed (common for snacks/confectionery)
 - Dietary Fibre (g) — use 0 if not listed
 - Fruit/Vegetable/Nut/Legume % — use 0 if not stated
-
-STEP 3 — APPLY CATEGORY-APPROPRIATE SCORING
-Use the correct thresholds based on category:
-
-FOR BEVERAGES (per 100ml):
-  Energy: 0pts=≤33kJ, +1pt per 6.7kJ, max 10pts
-  Sat Fat: 0pts=≤0.1g, +1pt per 0.14g, max 10pts
-  Sugars:  0pts=≤0.5g, +1pt per 2.25g, max 10pts
-  Sodium:  0pts=≤30mg, +1pt per 90mg, max 10pts
-  Protein modifying: NOT applied for beverages (use 0)
-  Fibre modifying: NOT applied for beverages (use 0)
-
-FOR DAIRY (per 100g or 100ml):
-  Use solid thresholds for solid dairy, liquid thresholds for liquid dairy.
-  Protein IS counted as a modifying point.
-  Calcium-rich products get a bonus — add 1 modifying point if calcium > 100mg/100g.
-
-FOR SNACKS / CONFECTIONERY (per 100g):
-  Energy: 0pts=≤335kJ, +1pt per 67kJ, max 10pts
-  Sat Fat: 0pts=≤1g, +1pt per 1.4g, max 10pts
-  Sugars:  0pts=≤1g, +1pt per 4.5g, max 10pts
-  Sodium:  0pts=≤90mg, +1pt per 270mg, max 10pts
-  Protein: apply only if > 5g/100g (snacks rarely have significant protein)
-  Fibre: apply normally — rewards whole grain snacks
-
-FOR ALL OTHER SOLIDS (per 100g):
-  Energy: 0pts=≤335kJ, +1pt per 67kJ, max 10pts
-  Sat Fat: 0pts=≤1g, +1pt per 1.4g, max 10pts
-  Sugars:  0pts=≤1g, +1pt per 4.5g, max 10pts
-  Sodium:  0pts=≤90mg, +1pt per 270mg, max 10pts
-  Protein: 0pts=≤1g, +1pt per 1.4g, max 5pts
-  Fibre:   0pts=≤0.9g, +1pt per 1g, max 5pts
-  FVNL%:   0pts=≤40%, +1pt per 10%, max 8pts
-
-Baseline = Energy + Sat Fat + Sugars + Sodium pts (max 40)
-Modifying = Protein + Fibre + FVNL pts (apply only what is relevant for category)
-Final Rating = normalize (Baseline minus Modifying) to a 1–5 scale. Round to nearest 0.5.
-★5 = healthiest, ★1 = least healthy. Never return 0 — minimum is 0.5.
-
-STEP 4 — INGREDIENTS ANALYSIS
-Scan the full ingredients list carefully:
-
-HSR Bad ingredients:
-  Artificial colours: E102 (Tartrazine), E104, E110 (Sunset Yellow), E122, E124, E129, E133, E142, E151, E155
-  Preservatives: E211 (Sodium Benzoate), E212, E213, E220, E221, E222, E223, E224, E249, E250, E251, E252
-  Artificial sweeteners: Aspartame (E951), Saccharin (E954), Acesulfame-K (E950), Sucralose (E955), Cyclamate (E952)
-  Trans fats: Hydrogenated oil, Partially hydrogenated oil, Vanaspati
-  Other: High-fructose corn syrup, MSG (E621), TBHQ (E319), BHA (E320), BHT (E321), Carrageenan (E407)
-
-FSSAI (India) restricted/banned additives — flag these separately as they are specifically restricted for Indian consumers:
-  - Potassium Bromate (E924) — banned in India for use in bread/flour
-  - Rhodamine B — banned food colourant found in street food/snacks
-  - Metanil Yellow (E105) — banned artificial colour in India
-  - Argemone Oil — toxic adulterant banned in India
-  - Brominated Vegetable Oil (BVO) — restricted in India
-  - Coal Tar dyes — banned in India
-  - Any additive listed as "not permitted" under FSSAI regulations
-
-Good ingredients:
-  Whole grains, oats, millets (ragi, jowar, bajra), nuts, seeds, legumes,
-  natural fibre, vitamins (A, B, C, D, E, K), minerals (calcium, iron, zinc),
-  probiotics, prebiotics, omega-3, antioxidants, natural fruit/vegetable content.
-
-List only ingredients actually visible on this label. Do not guess or invent.
-
-STEP 5 — EXPIRY DATE
+- Calcium (mg) — use 0 if not listed
+If only per-serving values are shown, convert them to per 100g/100ml using the serving size.
+If the energy, saturated fat, sugars or sodium value cannot be read at all, use null — never guess.
+
+STEP 3 — INGREDIENTS
+Copy the full ingredients list exactly as printed, in English, including every
+E-number / INS number and bracketed code (e.g. "Preservative (211)"). Do not
+judge or filter it — additives are flagged separately.
+Then list the good ingredients: whole grains, oats, millets (ragi, jowar, bajra),
+nuts, seeds, legumes, natural fibre, vitamins, minerals, probiotics, omega-3,
+natural fruit/vegetable content. Only list what is actually on this label.
+
+STEP 4 — EXPIRY DATE
 Find Best Before / Use By / Expiry / MFG date on the label. Return it or "Not visible".
 
-STEP 6 — READING CONFIDENCE
+STEP 5 — READING CONFIDENCE
 Assess how clearly you could read this label:
 - "high" = nutrition table and ingredients list fully visible and readable
 - "medium" = partially visible, some values estimated or inferred
@@ -133,22 +219,23 @@ Assess how clearly you could read this label:
 OUTPUT — Reply ONLY in this exact JSON with no markdown, no extra text:
 {
   "category": "<one of the category strings from Step 1>",
-  "rating": "<number 0.5 to 5, nearest 0.5>",
+  "brand": "<brand name as printed on label, or Unknown if not visible>",
+  "product_type": "<2-4 words for the specific product e.g. instant noodles, potato chips>",
+  "barcode": "<digits printed under the barcode, or null if not visible>",
   "confidence": "<high|medium|low>",
-  "score_breakdown": {
-    "energy_pts": <number>,
-    "satfat_pts": <number>,
-    "sugar_pts": <number>,
-    "sodium_pts": <number>,
-    "protein_pts": <number>,
-    "fibre_pts": <number>,
-    "fvnl_pts": <number>,
-    "baseline": <number>,
-    "modifying": <number>
+  "nutrients": {
+    "basis": "<100g|100ml>",
+    "energy_kj": <number or null>,
+    "sat_fat_g": <number or null>,
+    "sugars_g": <number or null>,
+    "sodium_mg": <number or null>,
+    "protein_g": <number>,
+    "fibre_g": <number>,
+    "fvnl_pct": <number>,
+    "calcium_mg": <number>
   },
+  "ingredients": "<full ingredients list as printed, or empty string if not visible>",
   "good_ingredients": ["<ingredient>"],
-  "bad_ingredients": ["<ingredient>"],
-  "fssai_flags": ["<FSSAI-restricted ingredient if found, else empty list>"],
   "reason": "<2-3 sentences on key health concerns or positives, mention category context — in English>",
   "reason_hi": "<same summary translated into simple Hindi (Devanagari script) — easy to understand for a common Indian consumer>",
   "reason_te": "<same summary translated into simple Telugu (Telugu script) — easy to understand for a common Indian consumer>",
@@ -156,7 +243,16 @@ OUTPUT — Reply ONLY in this exact JSON with no markdown, no extra text:
 }
 """.strip()
 
-ALTERNATIVE_PROMPT_TEMPLATE = """
+# Fallback for sessions whose stored analysis has no brand / product type
+IDENTIFY_PROMPT = (
+    "Look at this food product label. Reply ONLY in this exact JSON format with no extra text, no markdown: "
+    '{"product_type": "<2-4 words for product category e.g. instant noodles, potato chips>", '
+    '"brand": "<brand name as printed on label, or Unknown if not visible>"}'
+)
+
+# The two recommendations are separate calls so each can run (and stream) as soon
+# as its own search finishes
+SAME_BRAND_PROMPT_TEMPLATE = """
 You are a nutrition expert helping Indian consumers find healthier food choices.
 
 The scanned product is: {product_name}
@@ -165,25 +261,38 @@ The brand of the scanned product is: {brand_name}
 Web search results:
 {search_results}
 
-Your task — ALWAYS provide TWO recommendations:
-
-RECOMMENDATION 1 — SAME BRAND VARIANT:
+Your task — SAME BRAND VARIANT:
 Check if "{brand_name}" makes a healthier variant of "{product_name}".
 Examples: whole wheat, low-sugar, baked instead of fried, lite/light, multigrain, high-fibre version.
 If a real same-brand variant exists, name it specifically.
 If absolutely no same-brand variant exists, set same_brand_name to null and same_brand_reason to "No healthier variant available from this brand."
 
-RECOMMENDATION 2 — DIFFERENT BRAND:
+Reply ONLY in this exact JSON format with no markdown, no extra text:
+{{
+  "same_brand_name": "<Brand — Healthier Variant Name, or null if none exists>",
+  "same_brand_reason": "<why this variant is healthier, or explanation if none exists>",
+  "same_brand_buy": "<where to buy in India>"
+}}
+""".strip()
+
+ALT_BRAND_PROMPT_TEMPLATE = """
+You are a nutrition expert helping Indian consumers find healthier food choices.
+
+The scanned product is: {product_name}
+The brand of the scanned product is: {brand_name}
+
+Web search results:
+{search_results}
+
+Your task — DIFFERENT BRAND:
 Identify the single BEST alternative brand product for "{product_name}" available in India
 (Amazon.in, BigBasket, DMart, Flipkart, health food stores).
+It must be from a different brand than "{brand_name}".
 Must be a real, named commercial product — no home-made options.
 Explain specific nutritional advantages (lower sugar, no trans fat, higher fibre, etc.).
 
 Reply ONLY in this exact JSON format with no markdown, no extra text:
 {{
-  "same_brand_name": "<Brand — Healthier Variant Name, or null if none exists>",
-  "same_brand_reason": "<why this variant is healthier, or explanation if none exists>",
-  "same_brand_buy": "<where to buy in India>",
   "alt_brand_name": "<Different Brand — Product Name>",
   "alt_brand_reason": "<2-3 sentences on specific nutritional advantages>",
   "alt_brand_buy": "<where to buy in India>"
@@ -199,46 +308,268 @@ def _session_key():
 
 
 def save_user_image(image_data, mime_type, category=None):
-    """Save image bytes to a temp file scoped to this user session."""
-    uid = _session_key()
-    path = os.path.join(TEMP_DIR, uid + '.bin')
-    meta_path = os.path.join(TEMP_DIR, uid + '.json')
-    with open(path, 'wb') as f:
-        f.write(image_data)
-    with open(meta_path, 'w') as f:
-        json.dump({'mime': mime_type, 'category': category}, f)
+    """Save image bytes to the shared image store, scoped to this user session."""
+    IMAGE_STORE.put(_session_key(), image_data, {'mime': mime_type, 'category': category})
+
+
+def update_user_image_meta(**meta):
+    """Attach extra fields (e.g. category) to this session's stored image without rewriting it."""
+    uid = session.get('uid')
+    if uid:
+        IMAGE_STORE.update_meta(uid, **meta)
 
 
 def load_user_image():
-    """Load image bytes for this user session. Returns (data, mime, category) or (None,None,None)."""
+    """Load image bytes for this user session. Returns (data, mime, meta) or (None,None,None)."""
     uid = session.get('uid')
     if not uid:
         return None, None, None
-    path = os.path.join(TEMP_DIR, uid + '.bin')
-    meta_path = os.path.join(TEMP_DIR, uid + '.json')
-    if not os.path.exists(path):
+    item = IMAGE_STORE.get(uid)
+    if item is None:
         return None, None, None
-    with open(path, 'rb') as f:
-        data = f.read()
-    meta = {}
-    if os.path.exists(meta_path):
-        with open(meta_path, 'r') as f:
-            meta = json.load(f)
-    return data, meta.get('mime', 'image/jpeg'), meta.get('category')
+    data, meta = item
+    return data, meta.get('mime', 'image/jpeg'), meta
+
+
+@app.context_processor
+def upload_settings():
+    # Lets the pages shrink photos to the size the server would cut them down to anyway
+    return {'upload_max_edge': IMAGE_MAX_EDGE}
+
+
+def limit_upload(max_bytes):
+    """Apply upload limits to this request before its body is touched.
+
+    Werkzeug refuses a body whose Content-Length is over `max_bytes` without
+    reading it, and stops a chunked one as soon as it passes the limit.
+    """
+    request.max_content_length = max_bytes
+    # Older pages send base64 data URLs: form fields a third larger than the photo
+    request.max_form_memory_size = UPLOAD_MAX_BYTES * 4 // 3 + 1024
+
+
+def read_upload(stream):
+    """Read one photo from a file-like upload. Stops one byte past UPLOAD_MAX_BYTES,
+    so an oversized photo is caught by a length check without being read in full."""
+    return stream.read(UPLOAD_MAX_BYTES + 1)
+
+
+def prepare_upload(image_data):
+    """Orient, downscale, re-encode and quality-check an uploaded label.
+
+    Returns (data, mime); raises ValueError (ImageQualityError for unreadable
+    photos) with a message that can be shown to the user.
+    """
+    with metrics.span('prepare_image'):
+        image_data, mime_type = prepare_image(image_data, max_edge=IMAGE_MAX_EDGE, fmt=IMAGE_FORMAT,
+                                              quality=IMAGE_QUALITY, grayscale=IMAGE_GRAYSCALE)
+    with metrics.span('quality_gate'):
+        QUALITY_GATE.check(image_data)
+    return image_data, mime_type
+
+
+def generate(parts, priority=PRIORITY_INTERACTIVE, schema=None):
+    """Call the model through admission control and MODEL_CALLER. With a `schema`
+    the model is constrained to reply with JSON of that shape.
+
+    Raises RateLimited / UpstreamUnavailable when we should back off, or the
+    upstream error once retries and the deadline are used up.
+    """
+    config = {'response_mime_type': 'application/json', 'response_schema': schema} if schema else None
+
+    def attempt(timeout):
+        waited = ADMISSION.acquire(priority, min(ADMISSION_MAX_WAIT[priority], timeout))
+        return model.generate_content(parts, generation_config=config,
+                                      request_options={'timeout': max(timeout - waited, 1)})
+    return MODEL_CALLER.call(attempt)
+
+
+def ask_model(kind, parts, priority):
+    """Schema-constrained model call for one of MODEL_SCHEMAS. Returns the validated
+    dict, or None if the reply couldn't be parsed (counted per kind)."""
+    schema = MODEL_SCHEMAS[kind]
+    with metrics.span(f'model_{kind}'), metrics.upstream('gemini', kind):
+        response = generate(parts, priority, schema)
+    metrics.record_tokens(kind, response)
+    with metrics.span(f'parse_{kind}'):
+        return RESPONSE_PARSER.parse(kind, schema, response.text)
+
 
+def backpressure_response(e):
+    response = jsonify({'error': str(e), 'retry_after': e.retry_after})
+    response.status_code = e.status_code
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
 
-def clean_json_response(text):
+
+def score_label(result):
+    """Fill rating and score_breakdown from the nutrients the model read off the label,
+    and bad_ingredients / fssai_flags from its ingredients list."""
+    if result and isinstance(result.get('nutrients'), dict):
+        result.update(score_product(result))
+    # Older cached analyses carry the model's own flags and no ingredients text
+    if result and isinstance(result.get('ingredients'), str):
+        result['bad_ingredients'], result['fssai_flags'] = ADDITIVE_MATCHER.match(result['ingredients'])
+    return result
+
+
+def catalogue_record(result, barcode=None):
+    """File an analysis in the product catalogue; a catalogue failure never fails the scan."""
+    try:
+        CATALOGUE.record(result, barcode)
+    except Exception as e:
+        print(f"Catalogue error: {e}")
+
+
+def analyse_label(image_data, mime_type, priority=PRIORITY_INTERACTIVE, barcode=None, owner=None):
+    """Run the HSR analysis for one label image.
+
+    A known `barcode` (detected client-side, and confirmed by an earlier model
+    read of the same digits) is answered from the catalogue and repeat images
+    from the cache; only unknown products reach the model.
+    `owner` (the session key) lets a re-shot of that session's own earlier
+    upload match the cache without being byte-identical; without one (compare,
+    batch — different products side by side) only identical images match.
+    """
+    with metrics.span('catalogue_lookup'):
+        result = CATALOGUE.lookup_barcode(barcode)
+    if barcode:
+        metrics.record_cache('catalogue', result is not None)
+    if result is None:
+        with metrics.span('analysis_cache'):
+            result = ANALYSIS_CACHE.get(image_data, owner)
+        metrics.record_cache('analysis', result is not None)
+        if result is None:
+            picture = {'mime_type': mime_type, 'data': image_data}
+            result = ask_model('hsr', [HSR_ANALYSIS_PROMPT, picture], priority)
+            # Only successful parses are cached, so a bad response can still be retried
+            if result:
+                ANALYSIS_CACHE.put(image_data, result, owner)
+                with metrics.span('catalogue_record'):
+                    catalogue_record(result, barcode)
+        elif barcode:
+            catalogue_record(result, barcode)
+    # Scored after the cache so threshold changes apply to cached extractions too
+    with metrics.span('score'):
+        return score_label(result)
+
+
+def identify_product(image_data, mime_type, meta):
+    """Return (product_name, brand_name), calling the model only if the session lacks them."""
+    product_name = meta.get('product_type') or ''
+    brand_name = meta.get('brand') or ''
+    if not product_name or not brand_name:
+        picture = {'mime_type': mime_type, 'data': image_data}
+        id_data = ask_model('identify', [IDENTIFY_PROMPT, picture], PRIORITY_BACKGROUND) or {}
+        product_name = product_name or id_data.get('product_type') or 'food product'
+        brand_name   = brand_name or id_data.get('brand') or 'Unknown'
+    return product_name, brand_name
+
+
+def web_search(query, num_results):
+    """Run one web search and format the hits as prompt text (cached per query)."""
+    def run():
+        text = ""
+        with metrics.upstream('google_search', 'search'):
+            for r in search(query, num_results=num_results, advanced=True):
+                try: text += f"Title: {r.title}\nSnippet: {r.description}\nURL: {r.url}\n\n"
+                except: text += str(r) + "\n\n"
+        return text or None
+    with metrics.span('search'):
+        return SEARCH_CACHE.get_or_compute(normalize_key(query, num_results), run, PROCESS_POOL) or ""
+
+
+def recommend(kind, template, search_query, num_results, product_name, brand_name):
+    """Search, then ask the model for a recommendation. Returns the validated dict or None."""
+    results_text = web_search(search_query, num_results)
+    prompt = template.format(
+        product_name=product_name,
+        brand_name=brand_name,
+        search_results=results_text
+    )
+    return ask_model(kind, prompt, PRIORITY_BACKGROUND)
+
+
+def find_same_brand(product_name, brand_name):
+    """Search 1 + recommendation: a healthier variant from the same brand."""
+    data = {}
+    try:
+        if brand_name and brand_name.lower() != 'unknown':
+            data = RECOMMENDATION_CACHE.get_or_compute(
+                normalize_key('same_brand', brand_name, product_name),
+                lambda: recommend('same_brand', SAME_BRAND_PROMPT_TEMPLATE,
+                                  f"{brand_name} healthier variant {product_name} India",
+                                  3, product_name, brand_name),
+                PROCESS_POOL
+            ) or {}
+    except BACKPRESSURE_ERRORS:
+        raise
+    except Exception as e:
+        print(f"Same-brand error: {e}")
+    return {
+        'same_brand_name': data.get('same_brand_name'),
+        'same_brand_reason': data.get('same_brand_reason', 'No healthier variant found from this brand.'),
+        'same_brand_buy': data.get('same_brand_buy', 'Check brand website'),
+    }
+
+
+def find_alt_brand(product_name, brand_name):
+    """Search 2 + recommendation: the best alternative brand in India."""
+    data = {}
     try:
-        text = re.sub(r'```(?:json)?', '', text).strip().strip('`')
-        json_match = re.search(r'\{.*\}', text, re.DOTALL)
-        if json_match:
-            content = json_match.group()
-            content = content.replace("None", "null")
-            return json.loads(content)
-        return json.loads(text)
+        data = RECOMMENDATION_CACHE.get_or_compute(
+            normalize_key('alt_brand', brand_name, product_name),
+            lambda: recommend('alt_brand', ALT_BRAND_PROMPT_TEMPLATE,
+                              f"healthiest {product_name} brand India nutritious",
+                              4, product_name, brand_name),
+            PROCESS_POOL
+        ) or {}
+    except BACKPRESSURE_ERRORS:
+        raise
     except Exception as e:
-        print(f"JSON Parsing Error: {e}\nRaw: {text[:300]}")
-        return None
+        print(f"Alt-brand error: {e}")
+    return {
+        'alt_brand_name': data.get('alt_brand_name', 'Not found'),
+        'alt_brand_reason': data.get('alt_brand_reason', 'Could not determine a specific alternative at this time.'),
+        'alt_brand_buy': data.get('alt_brand_buy', 'Check BigBasket or Amazon.in'),
+    }
+
+
+def alternative_events(image_data, mime_type, meta):
+    """Yield /process progress events; the two recommendation pipelines run concurrently.
+
+    Stages: identifying → searching → same_brand / alt_brand (whichever finishes
+    first) → done, which carries the merged result.
+    """
+    yield {'stage': 'identifying'}
+    product_name, brand_name = identify_product(image_data, mime_type, meta)
+    print(f"Product: {product_name} | Brand: {brand_name}")
+    yield {'stage': 'searching', 'product_name': product_name, 'brand_name': brand_name}
+
+    # Stored alternatives live as long as a fresh recommendation-cache entry (and
+    # not at all with RECOMMENDATION_CACHE_SIZE=0); past that the pipelines below
+    # answer, from the cache's stale entries where it still has them
+    remember = RECOMMENDATION_CACHE.max_entries > 0
+    stored = remember and CATALOGUE.alternatives(brand_name, product_name, RECOMMENDATION_CACHE.ttl)
+    if stored:
+        yield dict(stored, stage='same_brand')
+        yield dict(stored, stage='alt_brand')
+        yield dict(stored, stage='done')
+        return
+
+    futures = {
+        metrics.submit(PROCESS_POOL, find_same_brand, product_name, brand_name): 'same_brand',
+        metrics.submit(PROCESS_POOL, find_alt_brand, product_name, brand_name): 'alt_brand',
+    }
+    data = {}
+    for future in as_completed(futures):
+        part = future.result()
+        data.update(part)
+        yield dict(part, stage=futures[future])
+    # Keep only real recommendations; fallbacks should be retried next time
+    if remember and data.get('alt_brand_name') not in (None, 'Not found'):
+        CATALOGUE.set_alternatives(brand_name, product_name, data)
+    yield dict(data, stage='done')
 
 
 def get_numeric_rating(rating_str):
@@ -254,6 +585,41 @@ def get_numeric_rating(rating_str):
     return None
 
 
+# ── Request tracing ────────────────────────────────────────────────────────────
+
+@app.before_request
+def start_trace():
+    rule = request.url_rule.rule if request.url_rule else 'unmatched'
+    g.trace = metrics.Trace(rule, request.headers.get('X-Request-ID'))
+    g.trace_token = metrics.activate(g.trace)
+    g.profiler = PROFILER.start()
+
+
+@app.after_request
+def finish_trace(response):
+    trace, profiler, status = g.trace, g.profiler, str(response.status_code)
+    response.headers['X-Request-ID'] = trace.request_id
+
+    # Runs once the body is fully sent, so streamed responses are timed to the end
+    def finish():
+        metrics.REQUEST_SECONDS.labels(trace.route, status).observe(trace.elapsed())
+        if profiler is not None:
+            report = PROFILER.stop(profiler, trace)
+            if report:
+                print(f"Profile saved: {report}")
+        if REQUEST_LOG and trace.route != '/metrics':
+            print(trace.log_line(status), flush=True)
+    response.call_on_close(finish)
+    return response
+
+
+@app.teardown_request
+def clear_trace(exc):
+    token = g.pop('trace_token', None)
+    if token is not None:
+        metrics.deactivate(token)
+
+
 # ── Routes ─────────────────────────────────────────────────────────────────────
 
 @app.route('/')
@@ -283,14 +649,20 @@ def how_page():
 
 @app.route('/capture', methods=['POST'])
 def capture_image():
+    limit_upload(UPLOAD_MAX_BYTES + 64 * 1024)
     try:
-        if 'file' in request.files:
+        if request.mimetype.startswith('image/'):
+            # The photo as the raw request body (fetch with a Blob, curl --data-binary)
+            with metrics.span('read_upload'):
+                image_data = read_upload(request.stream)
+
+        elif 'file' in request.files:
             file = request.files['file']
             if not file or file.filename == '':
                 return render_template('index.html', title="Scan Your Label", subtitle="#Label_Samjhega_India",
                                        error="No file selected. Please choose an image.")
-            image_data = file.read()
-            mime_type = 'image/jpeg' if file.filename.lower().endswith(('.jpg', '.jpeg')) else 'image/png'
+            with metrics.span('read_upload'):
+                image_data = read_upload(file)
 
         elif 'image_data' in request.form:
             image_data_url = request.form['image_data']
@@ -298,18 +670,27 @@ def capture_image():
                 return render_template('index.html', title="Scan Your Label", subtitle="#Label_Samjhega_India",
                                        error="Invalid image data. Please try again.")
             _, encoded = image_data_url.split(',', 1)
-            image_data = base64.b64decode(encoded)
-            mime_type = 'image/jpeg'
+            with metrics.span('decode_base64'):
+                image_data = base64.b64decode(encoded)
         else:
             return render_template('index.html', title="Scan Your Label", subtitle="#Label_Samjhega_India",
                                    error="No image received. Please try again.")
 
+        try:
+            if len(image_data) > UPLOAD_MAX_BYTES:
+                raise ValueError(UPLOAD_TOO_LARGE)
+            image_data, mime_type = prepare_upload(image_data)
+        except ValueError as e:
+            metrics.record_error(e)
+            return render_template('index.html', title="Scan Your Label", subtitle="#Label_Samjhega_India",
+                                   error=str(e))
+
         # Save image scoped to this user's session (safe for concurrent users)
-        save_user_image(image_data, mime_type)
+        with metrics.span('store_image'):
+            save_user_image(image_data, mime_type)
 
-        picture = {'mime_type': mime_type, 'data': image_data}
-        response = model.generate_content([HSR_ANALYSIS_PROMPT, picture])
-        result = clean_json_response(response.text)
+        result = analyse_label(image_data, mime_type, barcode=request.values.get('barcode'),
+                               owner=_session_key())
 
         if not result:
             result = {}
@@ -318,8 +699,10 @@ def capture_image():
         result.setdefault('confidence', 'medium')
         result.setdefault('reason_hi', '')
         result.setdefault('reason_te', '')
-        # Cache category with image for faster /process
-        save_user_image(image_data, mime_type, category=result.get('category', 'other'))
+        # Keep what /process needs with the image so it can search without another model call
+        update_user_image_meta(category=result.get('category', 'other'),
+                               brand=str(result.get('brand') or '').strip(),
+                               product_type=str(result.get('product_type') or '').strip())
         result.setdefault('reason', 'Unable to fully analyze this label.')
         result.setdefault('expiry', 'Not visible')
         result.setdefault('good_ingredients', [])
@@ -330,13 +713,25 @@ def capture_image():
         numeric_rating = get_numeric_rating(result['rating'])
         show_alternative = numeric_rating is not None and numeric_rating < 5
 
-        return render_template('results.html',
-                               title="Your Results",
-                               subtitle="",
-                               response=result,
-                               show_alternative=show_alternative)
+        with metrics.span('render'):
+            return render_template('results.html',
+                                   title="Your Results",
+                                   subtitle="",
+                                   response=result,
+                                   show_alternative=show_alternative)
+
+    except BACKPRESSURE_ERRORS as e:
+        metrics.record_error(e)
+        return render_template('index.html', title="Scan Your Label", subtitle="#Label_Samjhega_India",
+                               error=str(e)), e.status_code, {'Retry-After': str(e.retry_after)}
+
+    except RequestEntityTooLarge as e:
+        metrics.record_error(e)
+        return render_template('index.html', title="Scan Your Label", subtitle="#Label_Samjhega_India",
+                               error=UPLOAD_TOO_LARGE), 413
 
     except Exception as e:
+        metrics.record_error(e)
         print(f"Capture error: {e}")
         return render_template('index.html', title="Scan Your Label", subtitle="#Label_Samjhega_India",
                                error=f"Analysis failed: {str(e)}")
@@ -344,7 +739,8 @@ def capture_image():
 
 @app.route('/process', methods=['GET'])
 def process_data():
-    image_data, mime_type, cached_category = load_user_image()
+    with metrics.span('load_image'):
+        image_data, mime_type, meta = load_user_image()
 
     if not image_data:
         return jsonify({"alt_brand_name": "No image found",
@@ -353,72 +749,35 @@ def process_data():
                         "same_brand_name": None,
                         "same_brand_reason": "",
                         "same_brand_buy": ""})
+
+    # ?stream=1 sends each stage as a line of NDJSON as soon as it is ready
+    if request.args.get('stream') == '1':
+        def generate():
+            try:
+                for event in alternative_events(image_data, mime_type, meta):
+                    yield json.dumps(event) + '\n'
+            except BACKPRESSURE_ERRORS as e:
+                metrics.record_error(e)
+                yield json.dumps({'stage': 'error', 'error': str(e), 'retry_after': e.retry_after}) + '\n'
+            except Exception as e:
+                metrics.record_error(e)
+                print(f"Process error: {e}")
+                yield json.dumps({'stage': 'error', 'error': str(e)}) + '\n'
+        return Response(metrics.traced(g.trace, generate()), mimetype='application/x-ndjson',
+                         headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
     try:
-        picture = {'mime_type': mime_type, 'data': image_data}
+        for event in alternative_events(image_data, mime_type, meta):
+            pass
+        event.pop('stage')
+        return jsonify(event)
 
-        # Use cached category if available, else re-identify (saves one AI call)
-        if cached_category and cached_category != 'other':
-            product_name = cached_category.replace('_', ' ')
-            # Still need brand — quick single-field call
-            brand_resp = model.generate_content([
-                "Look at this food product label. What is the brand name printed on it? "
-                "Reply with ONLY the brand name — nothing else. If not visible, reply: Unknown",
-                picture
-            ])
-            brand_name = brand_resp.text.strip().strip('"').strip("'")
-        else:
-            id_prompt = (
-                "Look at this food product label. Reply ONLY in this exact JSON format with no extra text, no markdown: "
-                '{"product_type": "<2-4 words for product category e.g. instant noodles, potato chips>", '
-                '"brand": "<brand name as printed on label, or Unknown if not visible>"}'
-            )
-            id_resp = model.generate_content([id_prompt, picture])
-            id_data = clean_json_response(id_resp.text) or {}
-            product_name = id_data.get('product_type', 'food product').strip().strip('"')
-            brand_name   = id_data.get('brand', 'Unknown').strip().strip('"')
-        print(f"Product: {product_name} | Brand: {brand_name}")
-
-        # Search 1: same brand healthier variant
-        same_brand_results = ""
-        if brand_name and brand_name.lower() != 'unknown':
-            q1 = f"{brand_name} healthier variant {product_name} India"
-            r1 = list(search(q1, num_results=3, advanced=True))
-            for r in r1:
-                try: same_brand_results += f"Title: {r.title}\nSnippet: {r.description}\nURL: {r.url}\n\n"
-                except: same_brand_results += str(r) + "\n\n"
-
-        # Search 2: best alternative brand in India
-        q2 = f"healthiest {product_name} brand India nutritious"
-        r2 = list(search(q2, num_results=4, advanced=True))
-        alt_results = ""
-        for r in r2:
-            try: alt_results += f"Title: {r.title}\nSnippet: {r.description}\nURL: {r.url}\n\n"
-            except: alt_results += str(r) + "\n\n"
-
-        results_text = same_brand_results + alt_results
-
-        prompt = ALTERNATIVE_PROMPT_TEMPLATE.format(
-            product_name=product_name,
-            brand_name=brand_name,
-            search_results=results_text
-        )
-
-        rec = model.generate_content(prompt)
-        data = clean_json_response(rec.text)
-
-        if not data:
-            data = {}
-
-        data.setdefault('same_brand_name', None)
-        data.setdefault('same_brand_reason', 'No healthier variant found from this brand.')
-        data.setdefault('same_brand_buy', 'Check brand website')
-        data.setdefault('alt_brand_name', 'Not found')
-        data.setdefault('alt_brand_reason', 'Could not determine a specific alternative at this time.')
-        data.setdefault('alt_brand_buy', 'Check BigBasket or Amazon.in')
-
-        return jsonify(data)
+    except BACKPRESSURE_ERRORS as e:
+        metrics.record_error(e)
+        return backpressure_response(e)
 
     except Exception as e:
+        metrics.record_error(e)
         print(f"Process error: {e}")
         return jsonify({"Alternative": "Unavailable", "Reason": str(e), "Where_to_Buy": ""})
 
@@ -433,64 +792,342 @@ def compare_page():
     return render_template('compare.html', title="Compare Products", subtitle="Which one is healthier?")
 
 
+def compare_slots():
+    """Slot ids in this compare request: legacy product_a/product_b, then product_<n>."""
+    keys = list(request.files) + list(request.form)
+    slots = [s for s in ('a', 'b') if f'product_{s}_file' in keys or f'product_{s}_data' in keys]
+    numbered = {m.group(1) for m in (re.match(r'product_(\d+)_(?:file|data)$', k) for k in keys) if m}
+    return slots + sorted(numbered, key=int)
+
+
+def read_compare_slot(slot):
+    """Read one compare slot's raw image bytes, or raise ValueError."""
+    # Accept either file upload or base64 camera data
+    if f'product_{slot}_file' in request.files:
+        f = request.files[f'product_{slot}_file']
+        if not f or f.filename == '':
+            raise ValueError(f'No file for product_{slot}')
+        image_data = read_upload(f)
+    else:
+        raw = request.form[f'product_{slot}_data']
+        if ',' not in raw:
+            raise ValueError(f'Invalid image data for product_{slot}')
+        _, encoded = raw.split(',', 1)
+        image_data = base64.b64decode(encoded)
+    if len(image_data) > UPLOAD_MAX_BYTES:
+        raise ValueError(UPLOAD_TOO_LARGE)
+    return image_data
+
+
+def analyse_upload(image_data, priority=PRIORITY_INTERACTIVE):
+    """Preprocess, gate and analyse one raw upload, filling defaults for missing fields."""
+    image_data, mime_type = prepare_upload(image_data)
+    result = analyse_label(image_data, mime_type, priority)
+
+    if not result:
+        result = {}
+
+    result.setdefault('category', 'other')
+    result.setdefault('rating', 'N/A')
+    result.setdefault('reason', 'Unable to analyze.')
+    result.setdefault('expiry', 'Not visible')
+    result.setdefault('good_ingredients', [])
+    result.setdefault('bad_ingredients', [])
+    result.setdefault('fssai_flags', [])
+    result.setdefault('score_breakdown', {})
+    return result
+
+
+def rank_products(products):
+    """Rank analysed products by rating, best first. Equal ratings share a rank.
+
+    Products that failed or couldn't be rated ('N/A') are left out.
+    """
+    scored = [(get_numeric_rating(p.get('rating')), p['slot']) for p in products if 'error' not in p]
+    scored = [(rating, slot) for rating, slot in scored if rating is not None]
+    scored.sort(key=lambda x: -x[0])
+    ranking = []
+    for i, (rating, slot) in enumerate(scored):
+        rank = ranking[-1]['rank'] if ranking and ranking[-1]['rating'] == rating else i + 1
+        ranking.append({'slot': slot, 'rank': rank, 'rating': rating})
+    return ranking
+
+
 @app.route('/compare/analyse', methods=['POST'])
 def compare_analyse():
+    """Analyse 2..COMPARE_MAX_PRODUCTS products concurrently and rank them.
+
+    Slots are product_a/product_b (the compare page) or product_1..product_N,
+    each as `_file` or base64 `_data`. A slot that fails carries an `error`
+    instead of sinking the whole comparison. `winner` is null unless at least
+    two products could be rated.
+    """
+    limit_upload(app.config['MAX_CONTENT_LENGTH'])
     try:
-        results = []
-        for slot in ['product_a', 'product_b']:
-            # Accept either file upload or base64 camera data
-            if slot + '_file' in request.files:
-                f = request.files[slot + '_file']
-                if not f or f.filename == '':
-                    return jsonify({'error': f'No file for {slot}'}), 400
-                image_data = f.read()
-                mime_type = 'image/jpeg' if f.filename.lower().endswith(('.jpg','.jpeg')) else 'image/png'
-            elif slot + '_data' in request.form:
-                raw = request.form[slot + '_data']
-                if ',' not in raw:
-                    return jsonify({'error': f'Invalid image data for {slot}'}), 400
-                _, encoded = raw.split(',', 1)
-                image_data = base64.b64decode(encoded)
-                mime_type = 'image/jpeg'
-            else:
-                return jsonify({'error': f'Missing image for {slot}'}), 400
-
-            picture = {'mime_type': mime_type, 'data': image_data}
-            response = model.generate_content([HSR_ANALYSIS_PROMPT, picture])
-            result = clean_json_response(response.text)
-
-            if not result:
-                result = {}
-
-            result.setdefault('category', 'other')
-            result.setdefault('rating', 'N/A')
-            result.setdefault('reason', 'Unable to analyze.')
-            result.setdefault('expiry', 'Not visible')
-            result.setdefault('good_ingredients', [])
-            result.setdefault('bad_ingredients', [])
-            result.setdefault('score_breakdown', {})
-            results.append(result)
-
-        # Determine winner
-        r_a = get_numeric_rating(results[0]['rating']) or 0
-        r_b = get_numeric_rating(results[1]['rating']) or 0
-        if r_a > r_b:
-            winner = 'a'
-        elif r_b > r_a:
-            winner = 'b'
-        else:
-            winner = 'tie'
-
-        return jsonify({
-            'product_a': results[0],
-            'product_b': results[1],
-            'winner': winner
-        })
+        slots = compare_slots()
+        if len(slots) < 2:
+            return jsonify({'error': 'Please provide at least two products to compare.'}), 400
+        if len(slots) > COMPARE_MAX_PRODUCTS:
+            return jsonify({'error': f'You can compare at most {COMPARE_MAX_PRODUCTS} products at once.'}), 400
+
+        # Read every upload on the request thread, then fan the model calls out.
+        # ValueErrors are bad input (not an image, failed quality gate, missing file)
+        products, futures = {}, {}
+        server_error = False
+        for slot in slots:
+            try:
+                with metrics.span('read_upload'):
+                    image_data = read_compare_slot(slot)
+                futures[metrics.submit(ANALYSIS_POOL, analyse_upload, image_data)] = slot
+            except Exception as e:
+                metrics.record_error(e)
+                server_error = server_error or not isinstance(e, ValueError)
+                products[slot] = {'slot': slot, 'error': str(e)}
+
+        limited = None
+        for future in as_completed(futures):
+            slot = futures[future]
+            try:
+                products[slot] = dict(future.result(), slot=slot)
+            except BACKPRESSURE_ERRORS as e:
+                metrics.record_error(e)
+                limited = e
+                products[slot] = {'slot': slot, 'error': str(e), 'retry_after': e.retry_after}
+            except ValueError as e:
+                metrics.record_error(e)
+                products[slot] = {'slot': slot, 'error': str(e)}
+            except Exception as e:
+                metrics.record_error(e)
+                print(f"Compare error ({slot}): {e}")
+                server_error = True
+                products[slot] = {'slot': slot, 'error': f'Analysis failed: {e}'}
+
+        products = [products[slot] for slot in slots]
+        failed = all('error' in p for p in products)
+        if failed and limited:
+            return backpressure_response(limited)
+        if failed:
+            return jsonify({'error': products[0]['error'], 'products': products}), 500 if server_error else 400
+
+        ranking = rank_products(products)
+        top = [r for r in ranking if r['rank'] == 1]
+        response = {
+            'products': products,
+            'ranking': ranking,
+            'winner': None if len(ranking) < 2 else top[0]['slot'] if len(top) == 1 else 'tie',
+        }
+        # Keep the two-product shape the compare page reads
+        for p in products:
+            if p['slot'] in ('a', 'b'):
+                response['product_' + p['slot']] = p
+        return jsonify(response)
+
+    except RequestEntityTooLarge as e:
+        metrics.record_error(e)
+        return jsonify({'error': 'These photos are too large to compare together. Please try smaller ones.'}), 413
 
     except Exception as e:
         print(f"Compare error: {e}")
         return jsonify({'error': str(e)}), 500
 
 
+def batch_items(stack):
+    """(name, read) pairs for every image in this batch request: `files` parts and/or a `zip`.
+
+    Flask closes request files once the view returns, before the streamed
+    response is consumed, so uploads are copied to temporary files on disk
+    (registered on the ExitStack `stack`, which removes them). Each item reads
+    its bytes back only when its turn comes; zip members stay compressed until then.
+    """
+    items = []
+    spool = None
+    for f in request.files.getlist('files'):
+        if f and f.filename:
+            if spool is None:
+                spool = stack.enter_context(tempfile.TemporaryFile())
+            start = spool.seek(0, os.SEEK_END)
+            shutil.copyfileobj(f.stream, spool)
+            items.append((f.filename, lambda start=start, end=spool.tell(): read_spooled(spool, start, end)))
+    archive = request.files.get('zip')
+    if archive is None and request.mimetype in ('application/zip', 'application/x-zip-compressed'):
+        archive = request.stream
+    if archive is not None:
+        copy = stack.enter_context(tempfile.TemporaryFile())
+        shutil.copyfileobj(archive, copy)
+        zf = stack.enter_context(zipfile.ZipFile(copy))
+        for info in sorted(zf.infolist(), key=lambda i: i.filename):
+            base = os.path.basename(info.filename)
+            if info.is_dir() or not base or base.startswith('.') or info.filename.startswith('__MACOSX/'):
+                continue
+            items.append((info.filename, lambda info=info: read_zip_member(zf, info)))
+    return items
+
+
+def read_spooled(spool, start, end):
+    if end - start > UPLOAD_MAX_BYTES:
+        raise ValueError(UPLOAD_TOO_LARGE)
+    spool.seek(start)
+    return spool.read(end - start)
+
+
+def read_zip_member(zf, info):
+    if info.file_size > UPLOAD_MAX_BYTES:
+        raise ValueError(UPLOAD_TOO_LARGE)
+    return zf.read(info)
+
+
+def batch_events(batch_id, items):
+    """Analyse batch items BATCH_CONCURRENCY at a time, yielding one event per item as it finishes.
+
+    Items already completed under this batch_id are replayed from BATCH_STORE
+    (`resumed: true`) instead of being analysed again.
+    """
+    yield {'batch_id': batch_id, 'total': len(items)}
+    pending = deque(enumerate(items))
+    futures = {}
+    ok = failed = 0
+    try:
+        while pending or futures:
+            while pending and len(futures) < BATCH_CONCURRENCY:
+                index, (name, read) = pending.popleft()
+                try:
+                    image_data = read()
+                except Exception as e:
+                    failed += 1
+                    yield {'index': index, 'name': name, 'status': 'error', 'error': str(e)}
+                    continue
+                key = content_hash(image_data)
+                stored = BATCH_STORE.get(batch_id, key)
+                if stored is not None:
+                    ok += 1
+                    yield {'index': index, 'name': name, 'status': 'ok', 'resumed': True, 'result': stored}
+                    continue
+                futures[metrics.submit(ANALYSIS_POOL, analyse_upload, image_data, PRIORITY_BULK)] = (index, name, key)
+            if not futures:
+                continue
+
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, name, key = futures.pop(future)
+                event = {'index': index, 'name': name}
+                try:
+                    result = future.result()
+                except BACKPRESSURE_ERRORS as e:
+                    metrics.record_error(e)
+                    event.update(status='error', error=str(e), retry_after=e.retry_after)
+                except ValueError as e:
+                    metrics.record_error(e)
+                    event.update(status='error', error=str(e))
+                except Exception as e:
+                    metrics.record_error(e)
+                    print(f"Batch error ({name}): {e}")
+                    event.update(status='error', error=f'Analysis failed: {e}')
+                else:
+                    BATCH_STORE.put(batch_id, key, name, result)
+                    event.update(status='ok', result=result)
+                if event['status'] == 'ok':
+                    ok += 1
+                else:
+                    failed += 1
+                yield event
+    finally:
+        # Client went away — don't start analyses nobody will read
+        for future in futures:
+            future.cancel()
+    yield {'done': True, 'batch_id': batch_id, 'ok': ok, 'failed': failed}
+
+
+@app.route('/batch', methods=['POST'])
+def batch_scan():
+    """Scan many labels in one request and stream results as NDJSON.
+
+    Send images as repeated `files` parts, a `zip` part, or a raw application/zip
+    body. Pass the same `batch_id` (query or form) to resume an interrupted batch.
+    """
+    request.max_content_length = BATCH_MAX_BYTES
+    request.max_form_parts = BATCH_MAX_ITEMS + 10
+    batch_id = request.args.get('batch_id') or request.form.get('batch_id') or uuid.uuid4().hex
+    if not re.fullmatch(r'[A-Za-z0-9_-]{1,64}', batch_id):
+        return jsonify({'error': 'batch_id may only contain letters, digits, - and _ (max 64).'}), 400
+    with ExitStack() as stack:
+        try:
+            items = batch_items(stack)
+        except zipfile.BadZipFile:
+            return jsonify({'error': 'The zip file could not be read.'}), 400
+        if not items:
+            return jsonify({'error': 'No images received. Send files or a zip archive.'}), 400
+        if len(items) > BATCH_MAX_ITEMS:
+            return jsonify({'error': f'A batch can contain at most {BATCH_MAX_ITEMS} images.'}), 400
+        # The temporary files now belong to the streamed response, which outlives this view
+        spooled = stack.pop_all()
+
+    def generate():
+        # Removed once the last event is sent or the client disconnects
+        with spooled:
+            for event in batch_events(batch_id, items):
+                yield json.dumps(event) + '\n'
+    return Response(stream_with_context(metrics.traced(g.trace, generate())), mimetype='application/x-ndjson',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/batch/<batch_id>', methods=['GET'])
+def batch_results(batch_id):
+    """Replay every completed item of a batch as NDJSON."""
+    def generate():
+        for name, result in BATCH_STORE.items(batch_id):
+            yield json.dumps({'name': name, 'status': 'ok', 'result': result}) + '\n'
+    return Response(generate(), mimetype='application/x-ndjson')
+
+
+@app.route('/stats')
+def stats():
+    """Operational counters for this worker: caches, image store, quality gate, admission queue."""
+    return jsonify({
+        'admission': ADMISSION.stats(),
+        'model_calls': MODEL_CALLER.stats(),
+        'image_store': IMAGE_STORE.stats(),
+        'analysis_cache': {'entries': len(ANALYSIS_CACHE)},
+        'search_cache': SEARCH_CACHE.stats(),
+        'recommendation_cache': RECOMMENDATION_CACHE.stats(),
+        'quality_gate': QUALITY_GATE.stats(),
+        'catalogue': CATALOGUE.stats(),
+        'model_output': RESPONSE_PARSER.stats(),
+    })
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus scrape endpoint: request/stage/upstream latency histograms, token,
+    cache and error counters — summed over all gunicorn workers."""
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
+
+
+# ── Catalogue CLI ──────────────────────────────────────────────────────────────
+# flask --app app catalogue export products.jsonl
+# flask --app app catalogue import products.jsonl
+
+catalogue_cli = AppGroup('catalogue', help='Bulk import/export of the product catalogue.')
+
+
+@catalogue_cli.command('export')
+@click.argument('path', type=click.File('w'), default='-')
+def catalogue_export(path):
+    """Write every catalogued product as JSON lines (stdout by default)."""
+    n = CATALOGUE.export(path)
+    click.echo(f'Exported {n} products.', err=True)
+
+
+@catalogue_cli.command('import')
+@click.argument('path', type=click.File('r'), default='-')
+def catalogue_import(path):
+    """Load products from a JSON-lines export."""
+    imported, skipped = CATALOGUE.import_(path)
+    click.echo(f'Imported {imported} products, skipped {skipped}.', err=True)
+
+
+app.cli.add_command(catalogue_cli)
+
+
 if __name__ == '__main__':
     app.run(host="0.0.0.0", port=8000, debug=True)
@@ -0,0 +1,49 @@
+import json
+import os
+import tempfile
+import time
+
+from local_db import ThreadLocalConnection
+
+
+# ── Batch scan results ─────────────────────────────────────────────────────────
+# Completed items are kept per batch so an interrupted batch can be re-sent with
+# the same batch_id and only the missing images are analysed again.
+
+class BatchStore:
+    def __init__(self, path=None, ttl=7 * 24 * 3600):
+        self.path = path or os.path.join(tempfile.gettempdir(), 'baagundhaaa_batches.db')
+        self.ttl = ttl
+        self._conn = ThreadLocalConnection(self.path)
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS items ('
+            ' batch_id TEXT NOT NULL, item_key TEXT NOT NULL, name TEXT NOT NULL, result TEXT NOT NULL,'
+            ' created REAL NOT NULL, PRIMARY KEY (batch_id, item_key))'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS items_created ON items (created)')
+
+    def get(self, batch_id, item_key):
+        """Return the stored result for this item, or None."""
+        row = self._conn().execute(
+            'SELECT result FROM items WHERE batch_id = ? AND item_key = ? AND created > ?',
+            (batch_id, item_key, time.time() - self.ttl)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, batch_id, item_key, name, result):
+        now = time.time()
+        conn = self._conn()
+        conn.execute('INSERT OR REPLACE INTO items (batch_id, item_key, name, result, created) VALUES (?, ?, ?, ?, ?)',
+                     (batch_id, item_key, name, json.dumps(result), now))
+        conn.execute('DELETE FROM items WHERE created <= ?', (now - self.ttl,))
+
+    def items(self, batch_id):
+        """Yield (name, result) for every completed item in a batch, oldest first."""
+        rows = self._conn().execute(
+            'SELECT name, result FROM items WHERE batch_id = ? AND created > ? ORDER BY created',
+            (batch_id, time.time() - self.ttl)
+        ).fetchall()
+        for name, result in rows:
+            yield name, json.loads(result)
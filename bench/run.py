@@ -0,0 +1,452 @@
+"""Offline load test: drive /capture, /process (plain and streamed) and /compare/analyse against gunicorn
+with Gemini and web search stubbed out, and print the results as JSON.
+
+    python bench/run.py --concurrency 32 --duration 60 --out results.json
+    python bench/run.py --worker-class gevent --workers 2 --env ANALYSIS_CACHE_SIZE=0
+    python bench/run.py --url http://127.0.0.1:8000 --server-pid 1234   # already running
+
+Each virtual user keeps its own session cookie and picks a scenario per request
+from --mix. /process needs a scanned label in the session, so a user's first
+/process is preceded by a successful /capture (timed as a capture). The
+process_stream scenario reads /process?stream=1 and also times the first
+recommendation, which is what the user waits for.
+
+A request only counts as ok if its body shows it worked: /capture renders its
+error page and /process its "Unavailable" reply with HTTP 200, so the status
+code alone would report failed scans as successes.
+"""
+import argparse
+import http.cookiejar
+import io
+import json
+import math
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageDraw
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ('capture', 'process', 'process_stream', 'compare')
+RECOMMENDATION_STAGES = ('same_brand', 'alt_brand')
+
+
+# ── Test images ────────────────────────────────────────────────────────────────
+
+def label_image(seed, size=(1280, 960)):
+    """A JPEG that looks enough like a label (lines of small text) to pass the quality gate."""
+    rng = random.Random(seed)
+    img = Image.new('RGB', size, tuple(rng.randint(200, 245) for _ in range(3)))
+    draw = ImageDraw.Draw(img)
+    for y in range(20, size[1] - 20, 22):
+        words = (''.join(rng.choice('abcdefNUTRION0123456789') for _ in range(rng.randint(3, 9)))
+                 for _ in range(size[0] // 60))
+        draw.text((20, y), ' '.join(words), fill=(20, 20, 20))
+    buf = io.BytesIO()
+    img.save(buf, 'JPEG', quality=85)
+    return buf.getvalue()
+
+
+def multipart(fields):
+    """(body, content_type) for {name: (filename, bytes)} file fields."""
+    boundary = uuid.uuid4().hex
+    body = bytearray()
+    for name, (filename, data) in fields.items():
+        body += (f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                 f'Content-Type: image/jpeg\r\n\r\n').encode()
+        body += data + b'\r\n'
+    body += f'--{boundary}--\r\n'.encode()
+    return bytes(body), f'multipart/form-data; boundary={boundary}'
+
+
+# ── Server ─────────────────────────────────────────────────────────────────────
+
+def start_server(args, workdir):
+    """Start gunicorn on bench.stub_app with isolated state under `workdir`. Returns the Popen."""
+    env = dict(os.environ)
+    env.update({
+        'BIND': f'127.0.0.1:{args.port}',
+        'WORKER_CLASS': args.worker_class,
+        'WEB_CONCURRENCY': str(args.workers),
+        'THREADS': str(args.threads),
+        'GEMINI_API_KEY': env.get('GEMINI_API_KEY', 'bench'),
+        # Fixed, so a session cookie signed by one worker is accepted by the others
+        'SECRET_KEY': 'bench',
+        'REQUEST_LOG': '0',
+        'IMAGE_STORE_PATH': os.path.join(workdir, 'images.db'),
+        'RATE_LIMIT_PATH': os.path.join(workdir, 'ratelimit.db'),
+        'CATALOGUE_PATH': os.path.join(workdir, 'catalogue.db'),
+        'BATCH_STORE_PATH': os.path.join(workdir, 'batches.db'),
+        'PROMETHEUS_MULTIPROC_DIR': os.path.join(workdir, 'metrics'),
+    })
+    if args.profile:
+        env['BENCH_PROFILE'] = os.path.abspath(args.profile)
+    if args.recordings:
+        env['BENCH_RECORDINGS'] = os.path.abspath(args.recordings)
+    if args.seed is not None:
+        env['BENCH_SEED'] = str(args.seed)
+    env.update(args.env)
+    log = open(os.path.join(workdir, 'gunicorn.log'), 'wb')
+    return subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'bench.stub_app:app'],
+                            cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+def wait_ready(url, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(url + '/faq', timeout=2).read()
+            return
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.25)
+    raise SystemExit(f'Server at {url} did not come up within {timeout}s')
+
+
+def worker_pids(master_pid):
+    """PIDs of the gunicorn workers under `master_pid` (Linux /proc), or [] if unknown."""
+    pids = []
+    for entry in os.listdir('/proc') if os.path.isdir('/proc') else []:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == master_pid:
+            pids.append(int(entry))
+    return sorted(pids)
+
+
+def rss_mb(pid):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+class MemorySampler(threading.Thread):
+    """Samples each worker's resident memory once a second; keeps peak and last values."""
+
+    def __init__(self, master_pid):
+        super().__init__(daemon=True)
+        self.master_pid = master_pid
+        self.peak, self.last = {}, {}
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.sample()
+            self.stopped.wait(1)
+
+    def sample(self):
+        for pid in worker_pids(self.master_pid):
+            mb = rss_mb(pid)
+            if mb is not None:
+                self.last[pid] = mb
+                self.peak[pid] = max(mb, self.peak.get(pid, 0))
+
+    def report(self):
+        self.sample()
+        workers = [{'pid': pid, 'rss_mb_peak': round(self.peak[pid], 1), 'rss_mb_end': round(self.last[pid], 1)}
+                   for pid in sorted(self.peak)]
+        return {'workers': workers,
+                'rss_mb_peak_total': round(sum(w['rss_mb_peak'] for w in workers), 1),
+                'rss_mb_peak_per_worker': max((w['rss_mb_peak'] for w in workers), default=None)}
+
+
+# ── Load ───────────────────────────────────────────────────────────────────────
+
+def capture_outcome(body):
+    """'ok' if /capture rendered a results page, else why not."""
+    if b'class="error-msg"' in body:
+        return 'error_page'
+    return 'ok' if b'id="gauge-num"' in body else 'unexpected_page'
+
+
+def process_outcome(body):
+    """'ok' if /process returned alternatives, else why not."""
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return 'invalid_json'
+    if 'alt_brand_name' not in data:
+        return 'unavailable'
+    return 'no_image' if data['alt_brand_name'] == 'No image found' else 'ok'
+
+
+def stream_outcome(events):
+    """'ok' if a streamed /process ended with alternatives, else why not."""
+    if not events:
+        return 'empty'
+    last = events[-1]
+    if last.get('stage') == 'error':
+        return 'error'
+    if last.get('stage') != 'done' or 'alt_brand_name' not in last:
+        return 'incomplete'
+    return 'no_image' if last['alt_brand_name'] == 'No image found' else 'ok'
+
+
+def compare_outcome(body):
+    """'ok' if every compared product was analysed, else why not."""
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return 'invalid_json'
+    if 'error' in data or 'ranking' not in data:
+        return 'error'
+    return 'slot_error' if any('error' in p for p in data.get('products', [])) else 'ok'
+
+
+class VirtualUser:
+    """One client with its own cookie jar (so /process finds its own scan).
+
+    Each scenario returns (seconds, outcome): 'ok', the HTTP status of a non-200
+    reply, the exception name of a failed connection, or '200:<reason>' for a
+    200 whose body reports a failure. process_stream adds the seconds to the
+    first recommendation event (None if none arrived).
+    """
+
+    def __init__(self, base_url, images, rng):
+        self.base_url = base_url
+        self.images = images
+        self.rng = rng
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        self.scanned = False
+
+    def request(self, path, check, body=None, content_type=None, timeout=180):
+        req = urllib.request.Request(self.base_url + path, data=body,
+                                     headers={'Content-Type': content_type} if content_type else {})
+        start = time.perf_counter()
+        try:
+            with self.opener.open(req, timeout=timeout) as resp:
+                content = resp.read()
+                status = resp.status
+        except urllib.error.HTTPError as e:
+            e.read()
+            status = e.code
+        except Exception as e:
+            return time.perf_counter() - start, type(e).__name__
+        seconds = time.perf_counter() - start
+        if status != 200:
+            return seconds, str(status)
+        outcome = check(content)
+        return seconds, outcome if outcome == 'ok' else f'200:{outcome}'
+
+    def image(self):
+        return self.rng.choice(self.images)
+
+    def capture(self):
+        body, ctype = multipart({'file': ('label.jpg', self.image())})
+        seconds, outcome = self.request('/capture', capture_outcome, body, ctype)
+        self.scanned = self.scanned or outcome == 'ok'
+        return seconds, outcome
+
+    def process(self):
+        return self.request('/process', process_outcome)
+
+    def process_stream(self):
+        start = time.perf_counter()
+        events, first = [], None
+        try:
+            with self.opener.open(self.base_url + '/process?stream=1', timeout=180) as resp:
+                for line in resp:
+                    if not line.strip():
+                        continue
+                    try:
+                        events.append(json.loads(line))
+                    except ValueError:
+                        return time.perf_counter() - start, '200:invalid_json', first
+                    if first is None and events[-1].get('stage') in RECOMMENDATION_STAGES:
+                        first = time.perf_counter() - start
+        except urllib.error.HTTPError as e:
+            e.read()
+            return time.perf_counter() - start, str(e.code), first
+        except Exception as e:
+            return time.perf_counter() - start, type(e).__name__, first
+        outcome = stream_outcome(events)
+        return time.perf_counter() - start, outcome if outcome == 'ok' else f'200:{outcome}', first
+
+    def compare(self):
+        body, ctype = multipart({'product_a_file': ('a.jpg', self.image()), 'product_b_file': ('b.jpg', self.image())})
+        return self.request('/compare/analyse', compare_outcome, body, ctype)
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {s: [] for s in SCENARIOS}
+        self._lock = threading.Lock()
+
+    def add(self, scenario, seconds, outcome, first=None):
+        with self._lock:
+            self.samples[scenario].append((seconds, outcome, first))
+
+
+def percentile(ordered, pct):
+    if not ordered:
+        return None
+    # Nearest-rank
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def summarise(samples, elapsed):
+    latencies = sorted(s for s, outcome, _ in samples if outcome == 'ok')
+    firsts = sorted(f for _, outcome, f in samples if outcome == 'ok' and f is not None)
+    errors = {}
+    for _, outcome, _ in samples:
+        if outcome != 'ok':
+            errors[outcome] = errors.get(outcome, 0) + 1
+    ms = lambda v: round(v * 1000, 1) if v is not None else None
+    first_recommendation = {
+        'first_recommendation_p50_ms': ms(percentile(firsts, 50)),
+        'first_recommendation_p95_ms': ms(percentile(firsts, 95)),
+        'first_recommendation_p99_ms': ms(percentile(firsts, 99)),
+    } if firsts else {}
+    return {
+        'requests': len(samples),
+        'ok': len(latencies),
+        'errors': errors,
+        'error_rate': round(1 - len(latencies) / len(samples), 4) if samples else None,
+        'rps': round(len(samples) / elapsed, 2) if elapsed else None,
+        'p50_ms': ms(percentile(latencies, 50)),
+        'p95_ms': ms(percentile(latencies, 95)),
+        'p99_ms': ms(percentile(latencies, 99)),
+        'mean_ms': ms(sum(latencies) / len(latencies)) if latencies else None,
+        'max_ms': ms(latencies[-1] if latencies else None),
+        **first_recommendation,
+    }
+
+
+def run_load(args, base_url, images):
+    weights = [args.mix.get(s, 0) for s in SCENARIOS]
+    recorder = Recorder()
+    stop_at = time.time() + args.duration
+    budget = threading.Semaphore(args.requests) if args.requests else None
+
+    def user_loop(n):
+        rng = random.Random((args.seed or 0) * 10007 + n)
+        user = VirtualUser(base_url, images, rng)
+        while time.time() < stop_at:
+            if budget is not None and not budget.acquire(blocking=False):
+                return
+            scenario = rng.choices(SCENARIOS, weights)[0]
+            if scenario.startswith('process') and not user.scanned:
+                recorder.add('capture', *user.capture())
+                if not user.scanned:
+                    continue
+            recorder.add(scenario, *getattr(user, scenario)())
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(user_loop, range(args.concurrency)))
+    return recorder, time.time() - start
+
+
+def fetch_json(url):
+    try:
+        with urllib.request.urlopen(url, timeout=10) as resp:
+            return json.load(resp)
+    except Exception:
+        return None
+
+
+# ── CLI ────────────────────────────────────────────────────────────────────────
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('--url', help='benchmark an already running server instead of starting one')
+    p.add_argument('--server-pid', type=int, help='gunicorn master pid of --url, for worker memory')
+    p.add_argument('--port', type=int, default=8765)
+    p.add_argument('--worker-class', default='gthread', choices=['gthread', 'gevent', 'sync'])
+    p.add_argument('--workers', type=int, default=2)
+    p.add_argument('--threads', type=int, default=32)
+    p.add_argument('--env', action='append', default=[], metavar='KEY=VALUE',
+                   help='extra server environment, e.g. cache sizes or GEMINI_RPM (repeatable)')
+    p.add_argument('--concurrency', type=int, default=16, help='virtual users')
+    p.add_argument('--duration', type=float, default=30, help='seconds of load')
+    p.add_argument('--requests', type=int, help='stop after this many requests instead')
+    p.add_argument('--warmup', type=float, default=0, help='seconds of unrecorded load first')
+    p.add_argument('--mix', default='capture=2,process=1,process_stream=1,compare=1',
+                   help='scenario weights: ' + ', '.join(SCENARIOS))
+    p.add_argument('--unique-images', type=int, default=40,
+                   help='distinct label photos; fewer means more cache hits')
+    p.add_argument('--profile', help='latency/error profile JSON (default bench/profile.json)')
+    p.add_argument('--recordings', help='recorded responses JSON (default bench/recordings.json)')
+    p.add_argument('--seed', type=int)
+    p.add_argument('--label', help='free-form name stored with the results')
+    p.add_argument('--out', help='write JSON here instead of stdout')
+    args = p.parse_args(argv)
+    args.env = dict(kv.split('=', 1) for kv in args.env)
+    args.mix = {k: float(v) for k, v in (kv.split('=') for kv in args.mix.split(','))}
+    if args.requests:
+        args.duration = float('inf')
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    images = [label_image(i) for i in range(args.unique_images)]
+    workdir = tempfile.mkdtemp(prefix='baagundhaaa_bench_')
+    server = None
+    try:
+        if args.url:
+            base_url, master_pid = args.url.rstrip('/'), args.server_pid
+        else:
+            server = start_server(args, workdir)
+            base_url, master_pid = f'http://127.0.0.1:{args.port}', server.pid
+        wait_ready(base_url)
+
+        if args.warmup:
+            warm = argparse.Namespace(**dict(vars(args), duration=args.warmup, requests=None))
+            run_load(warm, base_url, images)
+
+        memory = MemorySampler(master_pid) if master_pid else None
+        if memory:
+            memory.start()
+        recorder, elapsed = run_load(args, base_url, images)
+        if memory:
+            memory.stopped.set()
+
+        everything = [s for samples in recorder.samples.values() for s in samples]
+        result = {
+            'label': args.label,
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'config': {k: v for k, v in vars(args).items() if k not in ('out',) and v != float('inf')},
+            'elapsed_s': round(elapsed, 2),
+            'total': summarise(everything, elapsed),
+            'scenarios': {s: summarise(recorder.samples[s], elapsed) for s in SCENARIOS if recorder.samples[s]},
+            'memory': memory.report() if memory else None,
+            'server_stats': fetch_json(base_url + '/stats'),
+        }
+    finally:
+        if server is not None:
+            server.terminate()
+            try:
+                server.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                server.kill()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    text = json.dumps(result, indent=2)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
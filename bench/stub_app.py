@@ -0,0 +1,16 @@
+# WSGI entry point for benchmarks: the real app with Gemini and web search
+# replaced by the stubs in bench/stubs.py.
+#   gunicorn -c gunicorn.conf.py bench.stub_app:app
+# BENCH_RECORDINGS / BENCH_PROFILE point at other recordings / latency profiles;
+# BENCH_SEED makes the latency and error sequence repeatable.
+import os
+
+import app as baagundhaaa
+from bench.stubs import StubBackend, StubModel, stub_search
+
+backend = StubBackend(recordings=os.getenv('BENCH_RECORDINGS'), profile=os.getenv('BENCH_PROFILE'),
+                      seed=os.getenv('BENCH_SEED'))
+baagundhaaa.model = StubModel(backend)
+baagundhaaa.search = stub_search(backend)
+
+app = baagundhaaa.app
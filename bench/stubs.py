@@ -0,0 +1,114 @@
+import json
+import math
+import os
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+
+# ── Stand-ins for Gemini and web search ────────────────────────────────────────
+# Replay recorded responses with a latency drawn from a log-normal distribution
+# (given as median and p95) and fail a configurable share of calls with errors
+# the app treats as retryable, so the whole resilience path is exercised.
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_RECORDINGS = os.path.join(HERE, 'recordings.json')
+DEFAULT_PROFILE = os.path.join(HERE, 'profile.json')
+
+Z95 = 1.645
+
+
+class ServiceUnavailable(Exception):
+    """Named like google.api_core's error so the app's retry logic treats it the same."""
+
+
+class DeadlineExceeded(Exception):
+    """Named like google.api_core's error: the call ran past its request timeout."""
+
+
+class Latency:
+    """Log-normal latency with the given median and p95, plus an error rate."""
+
+    def __init__(self, median_ms=1000, p95_ms=None, error_rate=0.0):
+        self.median = median_ms / 1000
+        p95 = (p95_ms or median_ms) / 1000
+        self.sigma = math.log(p95 / self.median) / Z95 if p95 > self.median > 0 else 0.0
+        self.error_rate = error_rate
+
+    def sample(self, rng):
+        return self.median * math.exp(rng.gauss(0, self.sigma)) if self.sigma else self.median
+
+
+def load_json(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+class StubBackend:
+    """Shared state for the stubs: recordings, latency profile and a seeded RNG."""
+
+    def __init__(self, recordings=None, profile=None, seed=None):
+        self.recordings = load_json(recordings or DEFAULT_RECORDINGS)
+        self.latency = {k: Latency(**v) for k, v in load_json(profile or DEFAULT_PROFILE).items()}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def draw(self, kind):
+        """(delay seconds, should fail, recorded response) for one call of `kind`."""
+        latency = self.latency.get(kind) or Latency()
+        with self._lock:
+            return (latency.sample(self._rng), self._rng.random() < latency.error_rate,
+                    self._rng.choice(self.recordings[kind]))
+
+
+def _call_kind(parts, generation_config):
+    """Which app call this is, from the response schema it asked for."""
+    schema = (generation_config or {}).get('response_schema') or {}
+    props = schema.get('properties', {})
+    if 'nutrients' in props:
+        return 'hsr'
+    if 'same_brand_name' in props:
+        return 'same_brand'
+    if 'alt_brand_name' in props:
+        return 'alt_brand'
+    return 'identify'
+
+
+def _prompt_tokens(parts):
+    parts = parts if isinstance(parts, list) else [parts]
+    # Roughly 4 characters per text token; Gemini bills an image at 258 tokens
+    return sum(len(p) // 4 if isinstance(p, str) else 258 for p in parts)
+
+
+class StubModel:
+    """Drop-in for genai.GenerativeModel.generate_content."""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def generate_content(self, parts, generation_config=None, request_options=None):
+        kind = _call_kind(parts, generation_config)
+        delay, fail, recorded = self.backend.draw(kind)
+        timeout = (request_options or {}).get('timeout')
+        if timeout is not None and delay > timeout:
+            time.sleep(timeout)
+            raise DeadlineExceeded(f'stub {kind} call exceeded {timeout:.1f}s')
+        time.sleep(delay)
+        if fail:
+            raise ServiceUnavailable(f'stub {kind} call failed')
+        text = json.dumps(recorded)
+        return SimpleNamespace(text=text, usage_metadata=SimpleNamespace(
+            prompt_token_count=_prompt_tokens(parts), candidates_token_count=len(text) // 4))
+
+
+def stub_search(backend):
+    """Drop-in for googlesearch.search(query, num_results, advanced=True)."""
+    def search(query, num_results=10, advanced=False, **kw):
+        delay, fail, hits = backend.draw('search')
+        time.sleep(delay)
+        if fail:
+            raise ConnectionError('stub search failed')
+        for hit in hits[:num_results]:
+            yield SimpleNamespace(**hit)
+    return search
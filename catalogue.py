@@ -0,0 +1,262 @@
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+
+from local_db import ThreadLocalConnection
+from ttl_cache import normalize_key
+
+
+# ── Local product catalogue ────────────────────────────────────────────────────
+# Every successful label analysis is filed under its normalised brand + product
+# type, and separately under its barcode when one was read. Many packs share a
+# brand + type (every flavour of one crisp), so the barcode rows each keep the
+# analysis read with that barcode: a scan that arrives with a known barcode is
+# answered from there without a model call. A barcode sent by the browser is
+# only trusted once the model has read the same digits off the label — until
+# then it is kept as unconfirmed and never answers a lookup, so a wrong or
+# forged code can't attach another product's analysis. /process reuses the alternatives
+# stored per brand + type for as long as the recommendation cache would. Unlike
+# the caches, products themselves don't expire — a product is replaced only
+# when a newer scan of it reads differently.
+
+# Fields that identify what is printed on the pack; a scan that differs in any
+# of them is treated as a changed product
+SIGNATURE_FIELDS = ('category', 'nutrients', 'ingredients', 'bad_ingredients', 'fssai_flags')
+UNKNOWN_BRANDS = {'', 'unknown', 'n/a', 'none', 'null'}
+
+
+def normalize_barcode(value):
+    """Digits of an EAN-8/UPC-A/EAN-13/GTIN-14 code, or None if it isn't one."""
+    digits = re.sub(r'[\s-]', '', str(value or ''))
+    return digits if re.fullmatch(r'\d{8}|\d{12,14}', digits) else None
+
+
+def product_key(brand, product_type):
+    """Catalogue key for a product, or None if the brand or type wasn't readable."""
+    if str(brand or '').strip().lower() in UNKNOWN_BRANDS or not str(product_type or '').strip():
+        return None
+    return normalize_key(brand, product_type)
+
+
+def _confirms(result, barcode):
+    """Whether the model read `barcode` off the label in `result`."""
+    return normalize_barcode(result.get('barcode')) == barcode
+
+
+def _signature(result):
+    return json.dumps({f: result.get(f) for f in SIGNATURE_FIELDS}, sort_keys=True)
+
+
+class ProductCatalogue:
+    """SQLite catalogue of analysed products, shared by all workers on the box."""
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(tempfile.gettempdir(), 'baagundhaaa_catalogue.db')
+        self._conn = ThreadLocalConnection(self.path)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.added = 0
+        self.changed = 0
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS products ('
+            ' key TEXT PRIMARY KEY, brand TEXT NOT NULL, product_type TEXT NOT NULL,'
+            ' result TEXT NOT NULL, signature TEXT NOT NULL, alternatives TEXT, alternatives_updated REAL,'
+            ' scans INTEGER NOT NULL DEFAULT 1, created REAL NOT NULL, updated REAL NOT NULL)'
+        )
+        if 'alternatives_updated' not in [row[1] for row in conn.execute('PRAGMA table_info(products)')]:
+            # Alternatives stored before they were timestamped count as expired
+            conn.execute('ALTER TABLE products ADD COLUMN alternatives_updated REAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS barcodes ('
+            ' barcode TEXT PRIMARY KEY, key TEXT NOT NULL, result TEXT NOT NULL, updated REAL NOT NULL,'
+            ' confirmed INTEGER NOT NULL DEFAULT 0)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS barcodes_key ON barcodes (key)')
+        columns = [row[1] for row in conn.execute('PRAGMA table_info(barcodes)')]
+        if 'confirmed' not in columns:
+            # Catalogues from before confirmation: keep the rows the label itself vouches for
+            conn.execute('ALTER TABLE barcodes ADD COLUMN confirmed INTEGER NOT NULL DEFAULT 0')
+            for barcode, result in conn.execute('SELECT barcode, result FROM barcodes').fetchall():
+                if _confirms(json.loads(result), barcode):
+                    conn.execute('UPDATE barcodes SET confirmed = 1 WHERE barcode = ?', (barcode,))
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def lookup_barcode(self, barcode):
+        """Stored analysis for a barcode, or None. Counts a catalogue hit/miss."""
+        barcode = normalize_barcode(barcode)
+        if not barcode:
+            return None
+        row = self._conn().execute('SELECT result FROM barcodes WHERE barcode = ? AND confirmed = 1',
+                                   (barcode,)).fetchone()
+        self._count('hits' if row else 'misses')
+        return json.loads(row[0]) if row else None
+
+    def record(self, result, barcode=None):
+        """File an analysis under its brand + product type. Returns 'new', 'changed', 'same' or None.
+
+        The analysis is also filed under the barcode the model read off the
+        label, replacing whatever that barcode held. A different `barcode`
+        (e.g. detected in the browser) is filed as unconfirmed: it answers no
+        lookups until a scan where the model reads the same digits.
+        """
+        key = product_key(result.get('brand'), result.get('product_type'))
+        if key is None:
+            return None
+        read = normalize_barcode(result.get('barcode'))
+        claimed = normalize_barcode(barcode)
+        signature = _signature(result)
+        now = time.time()
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT signature FROM products WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                conn.execute('INSERT INTO products (key, brand, product_type, result, signature,'
+                             ' created, updated) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                             (key, str(result['brand']).strip(), str(result['product_type']).strip(),
+                              json.dumps(result), signature, now, now))
+                status = 'new'
+            elif row[0] != signature:
+                # New recipe, a better read or another flavour — keep the latest, and re-fetch alternatives
+                conn.execute('UPDATE products SET result = ?, signature = ?, alternatives = NULL,'
+                             ' scans = scans + 1, updated = ? WHERE key = ?',
+                             (json.dumps(result), signature, now, key))
+                status = 'changed'
+            else:
+                conn.execute('UPDATE products SET scans = scans + 1 WHERE key = ?', (key,))
+                status = 'same'
+            if read:
+                self._put_barcode(conn, read, key, result, now)
+            if claimed and claimed != read:
+                self._put_barcode(conn, claimed, key, result, now)
+            conn.execute('COMMIT')
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        if status != 'same':
+            self._count('added' if status == 'new' else 'changed')
+        return status
+
+    @staticmethod
+    def _put_barcode(conn, barcode, key, result, updated):
+        """File `result` under `barcode` unless the stored one is newer or confirmed and this isn't."""
+        return conn.execute('INSERT INTO barcodes (barcode, key, result, updated, confirmed)'
+                            ' VALUES (?, ?, ?, ?, ?)'
+                            ' ON CONFLICT (barcode) DO UPDATE SET key = excluded.key,'
+                            ' result = excluded.result, updated = excluded.updated,'
+                            ' confirmed = excluded.confirmed'
+                            ' WHERE excluded.confirmed > barcodes.confirmed'
+                            ' OR (excluded.confirmed = barcodes.confirmed AND excluded.updated >= barcodes.updated)',
+                            (barcode, key, json.dumps(result), updated,
+                             int(_confirms(result, barcode)))).rowcount
+
+    def alternatives(self, brand, product_type, max_age):
+        """Stored /process result for a product if stored within `max_age` seconds, or None."""
+        key = product_key(brand, product_type)
+        if key is None:
+            return None
+        row = self._conn().execute('SELECT alternatives FROM products WHERE key = ? AND alternatives_updated > ?',
+                                   (key, time.time() - max_age)).fetchone()
+        return json.loads(row[0]) if row and row[0] else None
+
+    def set_alternatives(self, brand, product_type, alternatives):
+        key = product_key(brand, product_type)
+        if key is not None:
+            self._conn().execute('UPDATE products SET alternatives = ?, alternatives_updated = ? WHERE key = ?',
+                                 (json.dumps(alternatives), time.time(), key))
+
+    # ── Bulk import / export (one JSON object per line) ──
+
+    def export(self, fp):
+        """Write every product, with its barcodes, to `fp` as JSON lines. Returns the number written."""
+        conn = self._conn()
+        barcodes = {}
+        for barcode, key, result, updated in conn.execute('SELECT barcode, key, result, updated FROM barcodes'):
+            barcodes.setdefault(key, {})[barcode] = {'result': json.loads(result), 'updated': updated}
+        n = 0
+        for key, brand, product_type, result, alternatives, alternatives_updated, scans, created, updated in \
+                conn.execute('SELECT key, brand, product_type, result, alternatives, alternatives_updated,'
+                             ' scans, created, updated FROM products ORDER BY key'):
+            fp.write(json.dumps({'brand': brand, 'product_type': product_type,
+                                 'barcodes': barcodes.get(key, {}), 'result': json.loads(result),
+                                 'alternatives': json.loads(alternatives) if alternatives else None,
+                                 'alternatives_updated': alternatives_updated,
+                                 'scans': scans, 'created': created, 'updated': updated}) + '\n')
+            n += 1
+        return n
+
+    def import_(self, fp):
+        """Load products written by export(). Returns (imported, skipped).
+
+        Rows replace same-keyed products, and barcodes the same barcode, unless
+        the stored one is newer. A single `barcode` (older exports) is filed with
+        the row's result.
+        """
+        imported = skipped = 0
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for line in fp:
+                if not line.strip():
+                    continue
+                row = json.loads(line)
+                result = row.get('result') or {}
+                brand = row.get('brand') or result.get('brand')
+                product_type = row.get('product_type') or result.get('product_type')
+                key = product_key(brand, product_type)
+                if key is None:
+                    skipped += 1
+                    continue
+                updated = row.get('updated') or time.time()
+                cur = conn.execute(
+                    'INSERT INTO products (key, brand, product_type, result, signature, alternatives,'
+                    ' alternatives_updated, scans, created, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'
+                    ' ON CONFLICT (key) DO UPDATE SET'
+                    ' result = excluded.result, signature = excluded.signature,'
+                    ' alternatives = excluded.alternatives, alternatives_updated = excluded.alternatives_updated,'
+                    ' updated = excluded.updated'
+                    ' WHERE excluded.updated >= products.updated',
+                    (key, str(brand).strip(), str(product_type).strip(), json.dumps(result),
+                     _signature(result),
+                     json.dumps(row['alternatives']) if row.get('alternatives') else None,
+                     row.get('alternatives_updated'),
+                     int(row.get('scans') or 1), row.get('created') or updated, updated))
+                barcodes = dict(row.get('barcodes') or {})
+                legacy = row.get('barcode') or result.get('barcode')
+                if legacy and legacy not in barcodes:
+                    barcodes[legacy] = {'result': result, 'updated': updated}
+                for barcode, entry in barcodes.items():
+                    barcode = normalize_barcode(barcode)
+                    if barcode:
+                        self._put_barcode(conn, barcode, key, entry.get('result') or result,
+                                          entry.get('updated') or updated)
+                if cur.rowcount:
+                    imported += 1
+                else:
+                    skipped += 1
+            conn.execute('COMMIT')
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        return imported, skipped
+
+    def stats(self):
+        conn = self._conn()
+        products = conn.execute('SELECT COUNT(*) FROM products').fetchone()[0]
+        barcodes, unconfirmed = conn.execute(
+            'SELECT COUNT(*), COUNT(*) - COALESCE(SUM(confirmed), 0) FROM barcodes').fetchone()
+        with self._lock:
+            return {'products': products, 'barcodes': barcodes, 'unconfirmed_barcodes': unconfirmed,
+                    'barcode_hits': self.hits,
+                    'barcode_misses': self.misses, 'added': self.added, 'changed': self.changed}
@@ -0,0 +1,44 @@
+# Gunicorn settings — run with: gunicorn -c gunicorn.conf.py app:app
+#
+# Almost all request time is spent waiting on Gemini and web search, so workers
+# are I/O-bound. Instead of adding memory-hungry sync workers, each worker keeps
+# many requests in flight:
+#   WORKER_CLASS=gthread (default) — WEB_CONCURRENCY processes × THREADS threads
+#   WORKER_CLASS=gevent            — WEB_CONCURRENCY processes × WORKER_CONNECTIONS
+#                                    greenlets (gevent, pinned in requirements.txt)
+#   WORKER_CLASS=sync              — the old one-request-per-worker behaviour
+import os
+import shutil
+import tempfile
+
+bind = os.getenv('BIND', '0.0.0.0:8000')
+workers = int(os.getenv('WEB_CONCURRENCY', 4))
+worker_class = os.getenv('WORKER_CLASS', 'gthread')
+threads = int(os.getenv('THREADS', 32))
+worker_connections = int(os.getenv('WORKER_CONNECTIONS', 500))
+
+# Model calls can take tens of seconds; don't let the arbiter kill a busy worker
+timeout = int(os.getenv('TIMEOUT', 120))
+graceful_timeout = 30
+keepalive = 5
+
+if worker_class == 'gevent':
+    # The Gemini SDK's default gRPC transport blocks the gevent hub; its REST
+    # transport goes through the patched socket module and yields properly
+    os.environ.setdefault('GEMINI_TRANSPORT', 'rest')
+
+# /metrics sums every worker's counters from files in this directory. It must be
+# set before the app (and prometheus_client) is imported in the workers.
+metrics_dir = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR',
+                                    os.path.join(tempfile.gettempdir(), 'baagundhaaa_metrics'))
+
+
+def on_starting(server):
+    # Counters from a previous run would otherwise be added to this one
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,118 @@
+import re
+
+import numpy as np
+
+
+# ── Health Star Rating scoring engine ──────────────────────────────────────────
+# The model only reads raw nutrient values off the label; everything below turns
+# them into points and a star rating, so identical inputs always get identical
+# ratings and thresholds can change without touching the prompt.
+
+# (points start above this value, +1 point per step, max points)
+SOLID_THRESHOLDS = {
+    'energy':  (335, 67, 10),     # kJ / 100g
+    'satfat':  (1, 1.4, 10),      # g
+    'sugar':   (1, 4.5, 10),      # g
+    'sodium':  (90, 270, 10),     # mg
+    'protein': (1, 1.4, 5),       # g
+    'fibre':   (0.9, 1, 5),       # g
+    'fvnl':    (40, 10, 8),       # %
+}
+LIQUID_THRESHOLDS = dict(SOLID_THRESHOLDS, **{
+    'energy':  (33, 6.7, 10),     # kJ / 100ml
+    'satfat':  (0.1, 0.14, 10),
+    'sugar':   (0.5, 2.25, 10),
+    'sodium':  (30, 90, 10),
+})
+
+# Label field for each scored nutrient (per 100g / 100ml)
+NUTRIENT_FIELDS = {
+    'energy':  'energy_kj',
+    'satfat':  'sat_fat_g',
+    'sugar':   'sugars_g',
+    'sodium':  'sodium_mg',
+    'protein': 'protein_g',
+    'fibre':   'fibre_g',
+    'fvnl':    'fvnl_pct',
+}
+# All four baseline values must be read off the label to score it: a missing one
+# would otherwise count as 0 points, the most favourable value possible
+BASELINE = ('energy', 'satfat', 'sugar', 'sodium')
+MODIFYING = ('protein', 'fibre', 'fvnl')
+
+SNACK_PROTEIN_MIN_G = 5          # snacks only earn protein points above this
+DAIRY_CALCIUM_BONUS_MG = 100     # dairy above this earns 1 extra modifying point
+
+# Net score (baseline − modifying) upper bound for each star band, best first
+RATING_BANDS = np.array([-11, -7, -2, 2, 6, 11, 15, 20, 24])
+RATINGS = np.array([5, 4.5, 4, 3.5, 3, 2.5, 2, 1.5, 1, 0.5])
+
+
+def _number(value):
+    """Parse a label value like 12, '12.5', '12.5 g' or '1,200' into a float. None if absent."""
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    m = re.search(r'-?\d+(?:\.\d+)?', str(value).replace(',', ''))
+    return float(m.group()) if m else None
+
+
+def _points(values, liquid, key):
+    start, step, cap = (np.where(liquid, LIQUID_THRESHOLDS[key][i], SOLID_THRESHOLDS[key][i]) for i in range(3))
+    # Round before ceil so float noise (e.g. 2.0000000000000004) doesn't add a point
+    pts = np.ceil(np.round((values - start) / step, 6))
+    return np.clip(pts, 0, cap)
+
+
+def score_batch(products):
+    """Score many products in one vectorised pass.
+
+    Each product is a dict with `category` and `nutrients` (the shape returned by
+    the label analysis). Returns one dict per product with `rating` (0.5–5) and
+    `score_breakdown`. Products missing any baseline nutrient get `rating: 'N/A'`,
+    an empty breakdown and `missing_nutrients` naming the label fields not read.
+    Missing modifying nutrients (protein, fibre, FVNL) only forgo their credit.
+    """
+    if not products:
+        return []
+
+    categories = [str(p.get('category') or 'other') for p in products]
+    nutrients = [p.get('nutrients') or {} for p in products]
+    raw = {k: [_number(n.get(field)) for n in nutrients] for k, field in NUTRIENT_FIELDS.items()}
+    values = {k: np.array([v if v is not None else 0.0 for v in col]) for k, col in raw.items()}
+    calcium = np.array([_number(n.get('calcium_mg')) or 0.0 for n in nutrients])
+    missing = [[NUTRIENT_FIELDS[k] for k in BASELINE if raw[k][i] is None] for i in range(len(products))]
+
+    beverage = np.array([c == 'beverage' for c in categories])
+    dairy = np.array([c == 'dairy' for c in categories])
+    snack = np.array([c == 'snack' for c in categories])
+    per_ml = np.array([str(n.get('basis', '')).replace(' ', '').lower().endswith('ml') for n in nutrients])
+    liquid = beverage | (dairy & per_ml)
+
+    pts = {k: _points(values[k], liquid, k) for k in NUTRIENT_FIELDS}
+    # Beverages are not credited for protein or fibre; snacks only for meaningful protein
+    pts['protein'] = np.where(beverage | (snack & (values['protein'] <= SNACK_PROTEIN_MIN_G)), 0, pts['protein'])
+    pts['fibre'] = np.where(beverage, 0, pts['fibre'])
+    calcium_pts = np.where(dairy & (calcium > DAIRY_CALCIUM_BONUS_MG), 1, 0)
+
+    baseline = sum(pts[k] for k in BASELINE)
+    modifying = sum(pts[k] for k in MODIFYING) + calcium_pts
+    ratings = RATINGS[np.searchsorted(RATING_BANDS, baseline - modifying, side='left')]
+
+    scored = []
+    for i in range(len(products)):
+        if missing[i]:
+            scored.append({'rating': 'N/A', 'score_breakdown': {}, 'missing_nutrients': missing[i]})
+            continue
+        breakdown = {f'{k}_pts': int(pts[k][i]) for k in NUTRIENT_FIELDS}
+        breakdown['calcium_pts'] = int(calcium_pts[i])
+        breakdown['baseline'] = int(baseline[i])
+        breakdown['modifying'] = int(modifying[i])
+        scored.append({'rating': float(ratings[i]), 'score_breakdown': breakdown})
+    return scored
+
+
+def score_product(product):
+    """Score a single product. See score_batch."""
+    return score_batch([product])[0]
@@ -0,0 +1,91 @@
+import io
+
+from PIL import Image, ImageOps, ImageStat
+
+
+# ── Image preprocessing before model upload ────────────────────────────────────
+# Labels only need to be legible, so uploads are normalised to a small, upright
+# JPEG/WebP before they are stored, hashed or sent to Gemini.
+
+# Formats Gemini accepts as-is, used when Pillow can't decode the upload (e.g. HEIC)
+MODEL_MIME_TYPES = {'image/jpeg', 'image/png', 'image/webp', 'image/heic', 'image/heif'}
+
+OUTPUT_FORMATS = {'JPEG': 'image/jpeg', 'WEBP': 'image/webp'}
+
+
+def sniff_mime(data):
+    """Detect the image type from its leading bytes. Returns a MIME type or None."""
+    head = data[:16]
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    if head.startswith((b'GIF87a', b'GIF89a')):
+        return 'image/gif'
+    if head.startswith(b'BM'):
+        return 'image/bmp'
+    if head[4:8] == b'ftyp':
+        brand = head[8:12]
+        if brand in (b'heic', b'heix', b'hevc', b'heim', b'heis'):
+            return 'image/heic'
+        if brand in (b'mif1', b'msf1', b'heif'):
+            return 'image/heif'
+        if brand in (b'avif', b'avis'):
+            return 'image/avif'
+    return None
+
+
+def _is_grayish(img, max_saturation):
+    """True if the image has (almost) no colour, so dropping chroma loses nothing."""
+    hsv = img.convert('RGB').resize((64, 64)).convert('HSV')
+    return ImageStat.Stat(hsv).mean[1] <= max_saturation
+
+
+def prepare_image(data, max_edge=1600, fmt='JPEG', quality=85, grayscale='auto', max_saturation=12):
+    """Return (bytes, mime) ready for the model.
+
+    Applies EXIF orientation, downscales so the longest edge is at most
+    `max_edge`, optionally converts to grayscale ('auto' only does so for images
+    that are already nearly colourless), and re-encodes as `fmt` at `quality`.
+    An upright JPEG that already fits is returned as uploaded (the pages shrink
+    photos before sending them), and otherwise the original bytes are kept when
+    re-encoding would not make them smaller.
+    Raises ValueError for data that is not a usable image.
+    """
+    mime = sniff_mime(data)
+    if mime is None:
+        raise ValueError("This file doesn't look like an image. Please upload a JPG, PNG or WebP photo.")
+    fmt = fmt.upper()
+    out_mime = OUTPUT_FORMATS.get(fmt, 'image/jpeg')
+
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            # JPEG can decode straight to a reduced size, far cheaper than a full decode + resize
+            full_size = img.size
+            img.draft('RGB', (max_edge, max_edge))
+            orientation = img.getexif().get(0x0112, 1)
+            oriented = ImageOps.exif_transpose(img)
+            changed = orientation != 1 or img.size != full_size or max(oriented.size) > max_edge
+            if max(oriented.size) > max_edge:
+                oriented.thumbnail((max_edge, max_edge), Image.LANCZOS)
+            if oriented.mode not in ('RGB', 'L'):
+                oriented = oriented.convert('RGB')
+            if grayscale == 'always' or (grayscale == 'auto' and oriented.mode == 'RGB'
+                                         and _is_grayish(oriented, max_saturation)):
+                oriented = oriented.convert('L')
+            # Re-encoding a JPEG that needs no changes would only compress it twice
+            if not changed and mime == out_mime and oriented.mode == img.mode:
+                return data, mime
+            buf = io.BytesIO()
+            oriented.save(buf, format=fmt if fmt in OUTPUT_FORMATS else 'JPEG', quality=quality, optimize=True)
+    except Exception:
+        if mime in MODEL_MIME_TYPES:
+            return data, mime
+        raise ValueError("We couldn't read this image. Please upload a JPG, PNG or WebP photo.")
+
+    out = buf.getvalue()
+    if not changed and mime in MODEL_MIME_TYPES and len(out) >= len(data):
+        return data, mime
+    return out, out_mime
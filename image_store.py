@@ -0,0 +1,169 @@
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from local_db import ThreadLocalConnection
+
+
+# ── Session image stores ───────────────────────────────────────────────────────
+# Both stores keep one image plus a small metadata dict per session uid, evict by
+# TTL and by a total byte budget, and count hits / misses / evictions.
+
+class _Counters:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def as_dict(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+
+class MemoryImageStore:
+    """In-process LRU store. Fast, but only visible to the worker that wrote it."""
+
+    def __init__(self, ttl=3600, max_bytes=256 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()     # uid -> [expires_at, data, meta]
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._counters = _Counters()
+
+    def _drop(self, uid):
+        _, data, _ = self._items.pop(uid)
+        self._bytes -= len(data)
+        self._counters.evictions += 1
+
+    def put(self, uid, data, meta):
+        with self._lock:
+            if uid in self._items:
+                self._bytes -= len(self._items.pop(uid)[1])
+            self._items[uid] = [time.time() + self.ttl, data, dict(meta)]
+            self._bytes += len(data)
+            now = time.time()
+            for k in [k for k, v in self._items.items() if v[0] <= now]:
+                self._drop(k)
+            while self._bytes > self.max_bytes and len(self._items) > 1:
+                self._drop(next(iter(self._items)))
+
+    def get(self, uid):
+        """Return (data, meta) for this uid, or None."""
+        with self._lock:
+            item = self._items.get(uid)
+            if item is None or item[0] <= time.time():
+                if item is not None:
+                    self._drop(uid)
+                self._counters.misses += 1
+                return None
+            item[0] = time.time() + self.ttl
+            self._items.move_to_end(uid)
+            self._counters.hits += 1
+            return item[1], dict(item[2])
+
+    def update_meta(self, uid, **meta):
+        with self._lock:
+            item = self._items.get(uid)
+            if item is not None:
+                item[2].update(meta)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters.as_dict(), entries=len(self._items), bytes=self._bytes,
+                        backend='memory')
+
+
+class SQLiteImageStore:
+    """SQLite-backed store shared by every worker process on the host.
+
+    Counters are per process; entries and bytes reflect the shared database.
+    """
+
+    def __init__(self, path, ttl=3600, max_bytes=256 * 1024 * 1024):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._conn = ThreadLocalConnection(self.path)
+        self._counters = _Counters()
+        self._lock = threading.Lock()
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS images ('
+            ' uid TEXT PRIMARY KEY, data BLOB NOT NULL, meta TEXT NOT NULL,'
+            ' size INTEGER NOT NULL, accessed REAL NOT NULL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS images_accessed ON images (accessed)')
+
+    def _count(self, name, n=1):
+        with self._lock:
+            setattr(self._counters, name, getattr(self._counters, name) + n)
+
+    def put(self, uid, data, meta):
+        now = time.time()
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(
+                'INSERT OR REPLACE INTO images (uid, data, meta, size, accessed) VALUES (?, ?, ?, ?, ?)',
+                (uid, sqlite3.Binary(data), json.dumps(meta), len(data), now)
+            )
+            evicted = conn.execute('DELETE FROM images WHERE accessed <= ?', (now - self.ttl,)).rowcount
+            # Drop least-recently used rows once the running total passes the byte budget
+            evicted += conn.execute(
+                'DELETE FROM images WHERE uid IN ('
+                ' SELECT uid FROM (SELECT uid, SUM(size) OVER (ORDER BY accessed DESC, uid) AS running'
+                ' FROM images) WHERE running > ? AND uid != ?)',
+                (self.max_bytes, uid)
+            ).rowcount
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        if evicted:
+            self._count('evictions', evicted)
+
+    def get(self, uid):
+        """Return (data, meta) for this uid, or None."""
+        now = time.time()
+        conn = self._conn()
+        row = conn.execute('SELECT data, meta, accessed FROM images WHERE uid = ?', (uid,)).fetchone()
+        if row is None or row[2] <= now - self.ttl:
+            self._count('misses')
+            return None
+        conn.execute('UPDATE images SET accessed = ? WHERE uid = ?', (now, uid))
+        self._count('hits')
+        return bytes(row[0]), json.loads(row[1])
+
+    def update_meta(self, uid, **meta):
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT meta FROM images WHERE uid = ?', (uid,)).fetchone()
+            if row is not None:
+                merged = dict(json.loads(row[0]), **meta)
+                conn.execute('UPDATE images SET meta = ? WHERE uid = ?', (json.dumps(merged), uid))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def stats(self):
+        entries, size = self._conn().execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM images').fetchone()
+        with self._lock:
+            return dict(self._counters.as_dict(), entries=entries, bytes=size, backend='sqlite')
+
+
+def create_image_store(backend=None, path=None, ttl=3600, max_bytes=256 * 1024 * 1024):
+    """Build the store named by `backend` ('sqlite' or 'memory')."""
+    backend = (backend or 'sqlite').lower()
+    if backend == 'memory':
+        return MemoryImageStore(ttl=ttl, max_bytes=max_bytes)
+    if backend == 'sqlite':
+        path = path or os.path.join(tempfile.gettempdir(), 'baagundhaaa_images.db')
+        return SQLiteImageStore(path, ttl=ttl, max_bytes=max_bytes)
+    raise ValueError(f"Unknown image store backend: {backend}")
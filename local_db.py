@@ -0,0 +1,36 @@
+import sqlite3
+import threading
+
+
+# ── Per-thread SQLite connections ──────────────────────────────────────────────
+# The on-disk stores (uploaded images, catalogue, Gemini quota, batches) are
+# shared by every worker on the box. sqlite3 connections can't be shared across
+# threads, so each thread opens its own per store and keeps it; the stores turn
+# on WAL so readers don't wait for a writer.
+
+
+def connect(path, timeout=10):
+    """Autocommit connection to `path` (transactions are explicit BEGIN/COMMIT).
+
+    `timeout` is how long SQLite itself waits on a locked database; 0 leaves
+    waiting to the caller.
+    """
+    conn = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+    # Durable at every checkpoint, not every commit — fine for these stores under WAL
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+
+class ThreadLocalConnection:
+    """Call to get this thread's connection to `path`, opened on first use."""
+
+    def __init__(self, path, timeout=10):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def __call__(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = connect(self.path, self.timeout)
+        return conn
@@ -0,0 +1,182 @@
+import contextvars
+import json
+import os
+import random
+import re
+import tempfile
+import time
+import uuid
+from contextlib import contextmanager
+
+from prometheus_client import (CollectorRegistry, Counter, Histogram, REGISTRY, CONTENT_TYPE_LATEST,
+                               generate_latest, multiprocess)
+
+try:
+    from pyinstrument import Profiler
+except ImportError:     # optional: pip install pyinstrument
+    Profiler = None
+
+
+# ── Request tracing and Prometheus metrics ─────────────────────────────────────
+# Every request gets a Trace (request id + timed spans) held in a context
+# variable, so code deep in the call stack can open a span without passing it
+# around. Spans feed the stage histogram and a one-line JSON log per request.
+# Under gunicorn, PROMETHEUS_MULTIPROC_DIR (set by gunicorn.conf.py) makes
+# /metrics report the sum over all workers.
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 45, 90)
+
+REQUEST_SECONDS = Histogram('baagundhaaa_request_seconds', 'Request latency, to the last byte sent',
+                            ['route', 'status'], buckets=BUCKETS)
+STAGE_SECONDS = Histogram('baagundhaaa_stage_seconds', 'Time spent in each stage of a request',
+                          ['route', 'stage'], buckets=BUCKETS)
+UPSTREAM_SECONDS = Histogram('baagundhaaa_upstream_seconds', 'Gemini and web search call latency',
+                             ['service', 'call', 'outcome'], buckets=BUCKETS)
+MODEL_TOKENS = Counter('baagundhaaa_model_tokens', 'Gemini tokens used', ['call', 'kind'])
+CACHE_LOOKUPS = Counter('baagundhaaa_cache_lookups', 'Cache and catalogue lookups', ['cache', 'result'])
+ERRORS = Counter('baagundhaaa_errors', 'Errors by route and exception type', ['route', 'type'])
+
+_current = contextvars.ContextVar('trace', default=None)
+
+
+class Trace:
+    """One request: its id, route and the (stage, seconds) spans recorded so far."""
+
+    def __init__(self, route, request_id=None):
+        self.route = route
+        # A caller-supplied id (X-Request-ID) is kept only if it is safe to log and use in file names
+        valid = request_id and re.fullmatch(r'[A-Za-z0-9._-]{1,64}', request_id)
+        self.request_id = request_id if valid else uuid.uuid4().hex
+        self.start = time.perf_counter()
+        self.spans = []     # appended from pool threads too; list.append is atomic
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def log_line(self, status):
+        return json.dumps({'request_id': self.request_id, 'route': self.route, 'status': status,
+                           'ms': round(self.elapsed() * 1000, 1),
+                           'spans': [{'stage': s, 'ms': round(d * 1000, 1)} for s, d in self.spans]})
+
+
+def activate(trace):
+    """Make `trace` current in this context. Returns a token for deactivate()."""
+    return _current.set(trace)
+
+
+def deactivate(token):
+    _current.reset(token)
+
+
+def current():
+    return _current.get()
+
+
+@contextmanager
+def span(stage):
+    """Time a block as one stage of the current request."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        trace = _current.get()
+        STAGE_SECONDS.labels(trace.route if trace else 'background', stage).observe(seconds)
+        if trace:
+            trace.spans.append((stage, seconds))
+
+
+@contextmanager
+def upstream(service, call):
+    """Time one upstream call, labelled by whether it raised."""
+    start = time.perf_counter()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'ok'
+    finally:
+        UPSTREAM_SECONDS.labels(service, call, outcome).observe(time.perf_counter() - start)
+
+
+def record_tokens(call, response):
+    """Count prompt/output tokens from a Gemini response's usage metadata, if present."""
+    usage = getattr(response, 'usage_metadata', None)
+    for kind, field in (('prompt', 'prompt_token_count'), ('output', 'candidates_token_count')):
+        n = getattr(usage, field, None)
+        if n:
+            MODEL_TOKENS.labels(call, kind).inc(n)
+
+
+def record_cache(cache, hit):
+    CACHE_LOOKUPS.labels(cache, hit if isinstance(hit, str) else ('hit' if hit else 'miss')).inc()
+
+
+def record_error(exc):
+    trace = _current.get()
+    ERRORS.labels(trace.route if trace else 'background', type(exc).__name__).inc()
+
+
+def submit(executor, fn, *args):
+    """executor.submit that carries the current trace into the worker thread."""
+    return executor.submit(contextvars.copy_context().run, fn, *args)
+
+
+def traced(trace, iterable):
+    """Re-enter `trace` while a streamed response body is being produced."""
+    it = iter(iterable)
+    try:
+        while True:
+            token = _current.set(trace)
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+            finally:
+                _current.reset(token)
+            yield item
+    finally:
+        # Client went away mid-stream: let the inner generator run its cleanup now
+        close = getattr(it, 'close', None)
+        if close:
+            close()
+
+
+def render():
+    """(body, content_type) for a Prometheus scrape."""
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+class RequestProfiler:
+    """Optional pyinstrument hook: profiles a random `sample_rate` share of requests
+    and keeps an HTML report for those slower than `min_seconds`."""
+
+    def __init__(self, sample_rate=0.0, min_seconds=1.0, directory=None):
+        self.sample_rate = sample_rate if Profiler is not None else 0.0
+        self.min_seconds = min_seconds
+        self.directory = directory or os.path.join(tempfile.gettempdir(), 'baagundhaaa_profiles')
+        if sample_rate > 0 and Profiler is None:
+            print("PROFILE_SAMPLE_RATE is set but pyinstrument is not installed — profiling disabled.")
+
+    def start(self):
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return None
+        profiler = Profiler(interval=0.005, async_mode='disabled')
+        profiler.start()
+        return profiler
+
+    def stop(self, profiler, trace):
+        """Stop `profiler`; returns the report path if the request was slow enough to keep."""
+        profiler.stop()
+        if trace.elapsed() < self.min_seconds:
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{trace.route.strip('/').replace('/', '_') or 'root'}"
+                                            f"-{trace.request_id}.html")
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(profiler.output_html())
+        return path
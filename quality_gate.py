@@ -0,0 +1,104 @@
+import io
+import threading
+
+import numpy as np
+from PIL import Image
+
+
+# ── Local image quality gate ───────────────────────────────────────────────────
+# A few milliseconds of NumPy on a downscaled copy catches photos the model could
+# never read (blurred, dark, washed out, tiny) before we pay for a model call.
+
+ANALYSIS_EDGE = 512     # metrics are measured at this size so thresholds don't depend on resolution
+
+FEEDBACK = {
+    'blurry': "The photo is blurry — hold your phone steady and tap to focus on the label.",
+    'dark': "The photo is too dark — move to better light or turn on the flash.",
+    'bright': "The photo is washed out — avoid glare and direct light on the label.",
+    'low_contrast': "The label text is hard to make out — try a flatter angle with even lighting.",
+    'small': "The image is too small — move closer so the label fills the frame.",
+}
+
+
+class ImageQualityError(ValueError):
+    """Raised when an image is too poor to analyse. `problems` lists the failed checks."""
+
+    def __init__(self, problems):
+        self.problems = problems
+        super().__init__(' '.join(FEEDBACK[p] for p in problems))
+
+
+def measure(image_data):
+    """Return sharpness (Laplacian variance), brightness, contrast and min_edge for an image."""
+    with Image.open(io.BytesIO(image_data)) as img:
+        min_edge = min(img.size)
+        img.draft('L', (ANALYSIS_EDGE, ANALYSIS_EDGE))
+        gray = img.convert('L')
+        gray.thumbnail((ANALYSIS_EDGE, ANALYSIS_EDGE))
+        px = np.asarray(gray, dtype=np.float32)
+    lap = px[1:-1, :-2] + px[1:-1, 2:] + px[:-2, 1:-1] + px[2:, 1:-1] - 4 * px[1:-1, 1:-1]
+    return {
+        'sharpness': float(lap.var()) if lap.size else 0.0,
+        'brightness': float(px.mean()),
+        'contrast': float(px.std()),
+        'min_edge': min_edge,
+    }
+
+
+class QualityGate:
+    """Rejects hopeless images with actionable feedback and counts what it gates."""
+
+    def __init__(self, enabled=True, min_sharpness=15, min_brightness=35, max_brightness=235,
+                 min_contrast=8, min_edge=240, glare_contrast=20):
+        self.enabled = enabled
+        self.min_sharpness = min_sharpness
+        self.min_brightness = min_brightness
+        self.max_brightness = max_brightness
+        self.min_contrast = min_contrast
+        self.min_edge = min_edge
+        # A white panel with crisp black text is bright too; it's only washed out
+        # when the text has faded as well
+        self.glare_contrast = glare_contrast
+        self._lock = threading.Lock()
+        self.checked = 0
+        self.rejected = 0
+        self.reasons = {p: 0 for p in FEEDBACK}
+
+    def problems(self, metrics):
+        found = []
+        if metrics['min_edge'] < self.min_edge:
+            found.append('small')
+        # Bad exposure also flattens edges and contrast, so only report the root cause
+        if metrics['brightness'] < self.min_brightness:
+            found.append('dark')
+        elif metrics['brightness'] > self.max_brightness and metrics['contrast'] < self.glare_contrast:
+            found.append('bright')
+        elif metrics['sharpness'] < self.min_sharpness:
+            found.append('blurry')
+        elif metrics['contrast'] < self.min_contrast:
+            found.append('low_contrast')
+        return found
+
+    def check(self, image_data):
+        """Raise ImageQualityError if the image fails any check; returns the metrics otherwise."""
+        if not self.enabled:
+            return None
+        try:
+            metrics = measure(image_data)
+        except Exception:
+            # Formats Pillow can't decode go to the model unchecked
+            return None
+        found = self.problems(metrics)
+        with self._lock:
+            self.checked += 1
+            if found:
+                self.rejected += 1
+                for p in found:
+                    self.reasons[p] += 1
+        if found:
+            raise ImageQualityError(found)
+        return metrics
+
+    def stats(self):
+        with self._lock:
+            return {'checked': self.checked, 'rejected': self.rejected, 'reasons': dict(self.reasons)}
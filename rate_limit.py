@@ -0,0 +1,157 @@
+import math
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from local_db import ThreadLocalConnection, connect
+
+
+# ── Cross-worker admission control for model calls ─────────────────────────────
+# One token bucket per host, kept in SQLite so every gunicorn worker draws from
+# the same Gemini quota. Callers wait in a bounded queue ordered by priority; if
+# a token can't be had before the caller's deadline they get RateLimited at once
+# instead of failing later inside the model call.
+#
+# All waiting happens in time.sleep, never inside SQLite: connections have no
+# busy timeout, and a locked database is retried from Python. SQLite's own busy
+# handler sleeps in C, which under gevent would stall every greenlet in the
+# worker; the patched time.sleep yields to them instead.
+
+PRIORITY_INTERACTIVE = 0    # /capture, /compare/analyse
+PRIORITY_BACKGROUND = 1     # /process alternatives
+PRIORITY_BULK = 2           # cache refreshes, batch jobs
+
+
+class RateLimited(Exception):
+    """No model quota available within the caller's deadline."""
+    status_code = 429
+
+    def __init__(self, retry_after, reason='Too many requests'):
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+        super().__init__(f"{reason} — please try again in {self.retry_after}s.")
+
+
+class AdmissionController:
+    """Token bucket (`rate` per second, `burst` capacity) with a priority wait queue."""
+
+    def __init__(self, path=None, rate=10.0, burst=20, max_queue=200):
+        self.path = path or os.path.join(tempfile.gettempdir(), 'baagundhaaa_ratelimit.db')
+        self.rate = rate
+        self.burst = burst
+        self.max_queue = max_queue
+        self._conn = ThreadLocalConnection(self.path, timeout=0)
+        self._lock = threading.Lock()
+        self.admitted = 0
+        self.rejected = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        # Setup runs before the worker serves anything, so it may block on other workers
+        conn = connect(self.path)
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS bucket (id INTEGER PRIMARY KEY CHECK (id = 0),'
+                         ' tokens REAL NOT NULL, updated REAL NOT NULL)')
+            conn.execute('CREATE TABLE IF NOT EXISTS waiters (id INTEGER PRIMARY KEY AUTOINCREMENT,'
+                         ' priority INTEGER NOT NULL, expires REAL NOT NULL)')
+            conn.execute('INSERT OR IGNORE INTO bucket (id, tokens, updated) VALUES (0, ?, ?)',
+                         (burst, time.time()))
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _begin(conn, deadline):
+        """BEGIN IMMEDIATE, sleeping between tries while another worker holds the lock.
+
+        Returns False if the lock couldn't be had before `deadline`.
+        """
+        delay = 0.001
+        while True:
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                return True
+            except sqlite3.OperationalError as e:
+                if 'locked' not in str(e) and 'busy' not in str(e):
+                    raise
+            if time.time() + delay > deadline:
+                return False
+            time.sleep(delay)
+            delay = min(delay * 2, 0.05)
+
+    def _refill(self, conn, now):
+        tokens, updated = conn.execute('SELECT tokens, updated FROM bucket WHERE id = 0').fetchone()
+        return min(self.burst, tokens + (now - updated) * self.rate)
+
+    def acquire(self, priority=PRIORITY_INTERACTIVE, max_wait=10.0):
+        """Take one token, waiting up to `max_wait` seconds. Returns seconds waited.
+
+        Raises RateLimited if the queue is full or the wait would pass the deadline.
+        """
+        if self.rate <= 0:
+            return 0.0
+        start = time.time()
+        deadline = start + max_wait
+        conn = self._conn()
+        waiter = None
+        try:
+            while True:
+                if not self._begin(conn, deadline):
+                    self._reject()
+                    raise RateLimited(deadline - start, 'Server is busy')
+                now = time.time()
+                try:
+                    # Drop queue entries left behind by crashed workers
+                    conn.execute('DELETE FROM waiters WHERE expires < ?', (now - 5,))
+                    if waiter is None:
+                        depth = conn.execute('SELECT COUNT(*) FROM waiters').fetchone()[0]
+                        if depth >= self.max_queue:
+                            conn.execute('COMMIT')
+                            self._reject()
+                            raise RateLimited(depth / self.rate, 'Server is busy')
+                        waiter = conn.execute('INSERT INTO waiters (priority, expires) VALUES (?, ?)',
+                                              (priority, deadline)).lastrowid
+                    ahead = conn.execute('SELECT COUNT(*) FROM waiters WHERE priority < ?'
+                                         ' OR (priority = ? AND id < ?)', (priority, priority, waiter)).fetchone()[0]
+                    tokens = self._refill(conn, now)
+                    if tokens >= ahead + 1:
+                        conn.execute('UPDATE bucket SET tokens = ?, updated = ? WHERE id = 0', (tokens - 1, now))
+                        conn.execute('DELETE FROM waiters WHERE id = ?', (waiter,))
+                        conn.execute('COMMIT')
+                        waiter = None
+                        return self._admit(time.time() - start)
+                    conn.execute('UPDATE bucket SET tokens = ?, updated = ? WHERE id = 0', (tokens, now))
+                    conn.execute('COMMIT')
+                except Exception:
+                    if conn.in_transaction:
+                        conn.execute('ROLLBACK')
+                    raise
+
+                needed = (ahead + 1 - tokens) / self.rate
+                if now + needed > deadline:
+                    self._reject()
+                    raise RateLimited(needed)
+                time.sleep(min(max(needed, 0.01), 0.25))
+        finally:
+            # Left behind if the lock stays busy; it expires with the deadline anyway
+            if waiter is not None and self._begin(conn, time.time() + 1):
+                conn.execute('DELETE FROM waiters WHERE id = ?', (waiter,))
+                conn.execute('COMMIT')
+
+    def _admit(self, waited):
+        with self._lock:
+            self.admitted += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+        return waited
+
+    def _reject(self):
+        with self._lock:
+            self.rejected += 1
+
+    def stats(self):
+        conn = self._conn()
+        depth = conn.execute('SELECT COUNT(*) FROM waiters WHERE expires >= ?', (time.time(),)).fetchone()[0]
+        with self._lock:
+            return {'queue_depth': depth, 'admitted': self.admitted, 'rejected': self.rejected,
+                    'wait_seconds_total': round(self.wait_total, 3), 'wait_seconds_max': round(self.wait_max, 3)}
@@ -0,0 +1,190 @@
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+# ── Deadlines, retries, hedging and a circuit breaker for upstream calls ───────
+
+# Upstream errors worth another try, matched by class name so google.api_core
+# doesn't have to be imported here
+RETRYABLE_ERRORS = {
+    'ResourceExhausted', 'TooManyRequests', 'ServiceUnavailable', 'InternalServerError',
+    'DeadlineExceeded', 'GatewayTimeout', 'BadGateway', 'Aborted',
+    'TimeoutError', 'ConnectionError', 'ModelTimeout',
+}
+
+
+class ModelTimeout(TimeoutError):
+    """The call did not finish within its deadline."""
+
+
+class UpstreamUnavailable(Exception):
+    """The circuit breaker is open — the upstream is failing, so we fail fast."""
+    status_code = 503
+
+    def __init__(self, retry_after):
+        self.retry_after = max(1, int(retry_after + 0.999))
+        super().__init__(f"The AI service is having trouble right now — please try again in {self.retry_after}s.")
+
+
+def is_retryable(exc):
+    return any(cls.__name__ in RETRYABLE_ERRORS for cls in type(exc).__mro__)
+
+
+class CircuitBreaker:
+    """Opens after `threshold` consecutive failures; after `reset_timeout` seconds
+    lets one trial call through (half-open) and closes again if it succeeds."""
+
+    def __init__(self, threshold=5, reset_timeout=30):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.trips = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        return 'half_open' if time.monotonic() - self.opened_at >= self.reset_timeout else 'open'
+
+    def before_call(self):
+        with self._lock:
+            if self.opened_at is None or self.threshold <= 0:
+                return
+            waited = time.monotonic() - self.opened_at
+            if waited < self.reset_timeout or self.trial_in_flight:
+                raise UpstreamUnavailable(max(self.reset_timeout - waited, 1))
+            self.trial_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.trial_in_flight or (self.threshold > 0 and self.failures >= self.threshold):
+                if self.opened_at is None or self.trial_in_flight:
+                    self.trips += 1
+                self.opened_at = time.monotonic()
+                self.trial_in_flight = False
+
+    def release_trial(self):
+        """A trial call ended without telling us anything about upstream health."""
+        with self._lock:
+            self.trial_in_flight = False
+
+
+class LatencyTracker:
+    """Rolling window of recent successful call latencies."""
+
+    def __init__(self, window=200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, pct, min_samples=20):
+        with self._lock:
+            if len(self._samples) < min_samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class ResilientCaller:
+    """Runs `attempt(timeout)` with an overall deadline, jittered retries on
+    retryable errors, an optional hedged duplicate once the first try passes the
+    p95 latency, and a circuit breaker shared by all callers."""
+
+    def __init__(self, deadline=45, retries=2, backoff=0.5, max_backoff=8, hedge=False,
+                 hedge_min_samples=20, breaker=None, max_workers=64):
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.hedge = hedge
+        self.hedge_min_samples = hedge_min_samples
+        self.breaker = breaker or CircuitBreaker()
+        self.latency = LatencyTracker()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='model')
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.retried = 0
+        self.hedged = 0
+        self.timeouts = 0
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _timed(self, attempt, timeout):
+        start = time.monotonic()
+        result = attempt(timeout)
+        self.latency.record(time.monotonic() - start)
+        return result
+
+    def _run_once(self, attempt, deadline):
+        """One logical try: the primary call plus, if it is slow, a hedged duplicate."""
+        remaining = deadline - time.monotonic()
+        pending = {self._pool.submit(self._timed, attempt, remaining)}
+        hedge_after = self.latency.percentile(95, self.hedge_min_samples) if self.hedge else None
+        if hedge_after is not None and hedge_after < remaining:
+            done, _ = wait(pending, timeout=hedge_after)
+            if not done:
+                self._count('hedged')
+                pending.add(self._pool.submit(self._timed, attempt, deadline - time.monotonic()))
+
+        error = None
+        while pending:
+            remaining = deadline - time.monotonic()
+            done, pending = wait(pending, timeout=max(remaining, 0), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+        if error is not None and not pending:
+            raise error
+        self._count('timeouts')
+        raise ModelTimeout(f"Model call exceeded its {self.deadline}s deadline")
+
+    def call(self, attempt):
+        """Return attempt(timeout)'s result, or raise its last error / ModelTimeout / UpstreamUnavailable."""
+        self._count('calls')
+        self.breaker.before_call()
+        deadline = time.monotonic() + self.deadline
+        for n in range(self.retries + 1):
+            try:
+                result = self._run_once(attempt, deadline)
+            except Exception as e:
+                if not is_retryable(e):
+                    self.breaker.release_trial()
+                    raise
+                self.breaker.record_failure()
+                delay = min(self.max_backoff, self.backoff * 2 ** n) * random.uniform(0.5, 1.5)
+                if n == self.retries or time.monotonic() + delay >= deadline:
+                    raise
+                self._count('retried')
+                time.sleep(delay)
+                self.breaker.before_call()
+                continue
+            self.breaker.record_success()
+            return result
+
+    def stats(self):
+        with self._lock:
+            return {'calls': self.calls, 'retried': self.retried, 'hedged': self.hedged,
+                    'timeouts': self.timeouts, 'breaker_state': self.breaker.state,
+                    'breaker_trips': self.breaker.trips,
+                    'p95_seconds': self.latency.percentile(95, 1)}
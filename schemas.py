@@ -0,0 +1,172 @@
+import json
+import threading
+
+
+# ── Structured model output ────────────────────────────────────────────────────
+# Each model call sends one of these schemas as its response_schema, so Gemini
+# replies with bare JSON of a known shape. ResponseParser then checks the reply
+# against the same schema and returns a clean dict holding only the declared
+# fields with the declared types. Missing fields are left out, so callers' own
+# defaults still apply; a reply missing a critical field counts as a failed parse.
+
+def _nullable(schema):
+    return dict(schema, nullable=True)
+
+
+STRING = {'type': 'STRING'}
+NUMBER = {'type': 'NUMBER'}
+STRING_LIST = {'type': 'ARRAY', 'items': STRING}
+
+CATEGORIES = ['beverage', 'dairy', 'snack', 'cereal', 'instant_meal', 'condiment', 'staple',
+              'health_product', 'fruit_vegetable', 'other']
+
+HSR_SCHEMA = {
+    'type': 'OBJECT',
+    'properties': {
+        'category': {'type': 'STRING', 'enum': CATEGORIES},
+        'brand': STRING,
+        'product_type': STRING,
+        'barcode': _nullable(STRING),
+        'confidence': {'type': 'STRING', 'enum': ['high', 'medium', 'low']},
+        'nutrients': {
+            'type': 'OBJECT',
+            'properties': {
+                'basis': {'type': 'STRING', 'enum': ['100g', '100ml']},
+                'energy_kj': _nullable(NUMBER),
+                'sat_fat_g': _nullable(NUMBER),
+                'sugars_g': _nullable(NUMBER),
+                'sodium_mg': _nullable(NUMBER),
+                'protein_g': NUMBER,
+                'fibre_g': NUMBER,
+                'fvnl_pct': NUMBER,
+                'calcium_mg': NUMBER,
+            },
+            'required': ['basis', 'energy_kj', 'sat_fat_g', 'sugars_g', 'sodium_mg',
+                         'protein_g', 'fibre_g', 'fvnl_pct', 'calcium_mg'],
+        },
+        'ingredients': STRING,
+        'good_ingredients': STRING_LIST,
+        'reason': STRING,
+        'reason_hi': STRING,
+        'reason_te': STRING,
+        'expiry': STRING,
+    },
+    'required': ['category', 'brand', 'product_type', 'confidence', 'nutrients', 'ingredients',
+                 'good_ingredients', 'reason', 'reason_hi', 'reason_te', 'expiry'],
+}
+
+IDENTIFY_SCHEMA = {
+    'type': 'OBJECT',
+    'properties': {'product_type': STRING, 'brand': STRING},
+    'required': ['product_type', 'brand'],
+}
+
+SAME_BRAND_SCHEMA = {
+    'type': 'OBJECT',
+    'properties': {'same_brand_name': _nullable(STRING), 'same_brand_reason': STRING, 'same_brand_buy': STRING},
+    'required': ['same_brand_name', 'same_brand_reason', 'same_brand_buy'],
+}
+
+ALT_BRAND_SCHEMA = {
+    'type': 'OBJECT',
+    'properties': {'alt_brand_name': STRING, 'alt_brand_reason': STRING, 'alt_brand_buy': STRING},
+    'required': ['alt_brand_name', 'alt_brand_reason', 'alt_brand_buy'],
+}
+
+# Fields without which a reply is useless; anything else missing gets a default
+CRITICAL_FIELDS = {
+    'hsr': ('category', 'nutrients'),
+    'identify': ('product_type',),
+    'same_brand': ('same_brand_reason',),
+    'alt_brand': ('alt_brand_name',),
+}
+
+
+class SchemaError(ValueError):
+    """The reply is JSON but doesn't fit the schema."""
+
+
+def coerce(schema, value, path='$'):
+    """Return `value` checked and converted to `schema`, or raise SchemaError."""
+    kind = schema['type']
+    if value is None:
+        if schema.get('nullable') or kind != 'OBJECT':
+            return None
+    if kind == 'OBJECT':
+        if not isinstance(value, dict):
+            raise SchemaError(f'{path}: expected an object')
+        return {name: coerce(prop, value[name], f'{path}.{name}')
+                for name, prop in schema['properties'].items() if name in value}
+    if kind == 'ARRAY':
+        if not isinstance(value, list):
+            raise SchemaError(f'{path}: expected a list')
+        return [coerce(schema['items'], v, f'{path}[]') for v in value if v is not None]
+    if kind == 'NUMBER':
+        if isinstance(value, bool):
+            raise SchemaError(f'{path}: expected a number')
+        if isinstance(value, (int, float)):
+            return value
+        try:
+            return float(str(value).replace(',', '').strip())
+        except ValueError:
+            if schema.get('nullable'):
+                return None
+            raise SchemaError(f'{path}: expected a number') from None
+    if kind == 'STRING':
+        value = str(value).strip()
+        enum = schema.get('enum')
+        if enum and value not in enum:
+            lowered = value.lower()
+            if lowered not in enum:
+                raise SchemaError(f'{path}: {value!r} is not one of {enum}')
+            value = lowered
+        return value
+    return value
+
+
+class ResponseParser:
+    """Parses model replies against their schema and counts how often that fails."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {kind: {'ok': 0, 'invalid_json': 0, 'invalid_schema': 0} for kind in CRITICAL_FIELDS}
+
+    def _count(self, kind, outcome):
+        with self._lock:
+            self.counts[kind][outcome] += 1
+
+    @staticmethod
+    def _load(text):
+        try:
+            return json.loads(text)
+        except ValueError:
+            # Without a schema (or on older models) the JSON may still come fenced
+            # or with a sentence around it — decode the first object in the text
+            start = text.find('{')
+            if start < 0:
+                raise
+            return json.JSONDecoder().raw_decode(text, start)[0]
+
+    def parse(self, kind, schema, text):
+        """Return the validated dict for a `kind` reply, or None if it can't be used."""
+        try:
+            data = self._load(text or '')
+        except ValueError as e:
+            self._count(kind, 'invalid_json')
+            print(f"JSON Parsing Error ({kind}): {e}\nRaw: {(text or '')[:300]}")
+            return None
+        try:
+            result = coerce(schema, data)
+            missing = [f for f in CRITICAL_FIELDS[kind] if f not in data or data[f] in (None, '')]
+            if missing:
+                raise SchemaError(f"missing {', '.join(missing)}")
+        except SchemaError as e:
+            self._count(kind, 'invalid_schema')
+            print(f"Schema Error ({kind}): {e}\nRaw: {(text or '')[:300]}")
+            return None
+        self._count(kind, 'ok')
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {kind: dict(c) for kind, c in self.counts.items()}
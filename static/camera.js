@@ -2,7 +2,10 @@ const video = document.getElementById('camera');
 const captureButton = document.getElementById('capture-button');
 const captureOptions = document.getElementById('capture-options');
 const imageInput = document.getElementById('image-data');
+const fileInput = document.getElementById('image-file');
+const confirmButton = document.getElementById('confirm-button');
 const cameraError = document.getElementById('camera-error');
+const barcodeInput = document.getElementById('barcode');
 const canvas = document.createElement('canvas');
 
 let stream;
@@ -41,8 +44,21 @@ function capture() {
     const context = canvas.getContext('2d');
     context.drawImage(video, 0, 0, canvas.width, canvas.height);
 
-    const dataURL = canvas.toDataURL('image/jpeg', 0.8);
-    imageInput.value = dataURL;
+    // Sent as a shrunk binary JPEG; browsers that can't attach a file to the
+    // form fall back to the old base64 data URL field
+    confirmButton.disabled = true;
+    encodeScaled(canvas, canvas.width, canvas.height)
+        .then(function (blob) {
+            if (!setInputFile(fileInput, blob, 'label.jpg')) throw new Error('Cannot attach file');
+            fileInput.disabled = false;
+            imageInput.value = '';
+        })
+        .catch(function () {
+            fileInput.disabled = true;
+            imageInput.value = canvas.toDataURL('image/jpeg', 0.8);
+        })
+        .then(function () { confirmButton.disabled = false; });
+    detectBarcode(canvas).then(function (code) { if (barcodeInput) barcodeInput.value = code; });
 
     video.pause();
     captureButton.style.display = 'none';
@@ -54,4 +70,6 @@ function retry() {
     captureButton.style.display = 'block';
     captureOptions.style.display = 'none';
     imageInput.value = '';
+    fileInput.value = '';
+    if (barcodeInput) barcodeInput.value = '';
 }
\ No newline at end of file
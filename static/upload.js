@@ -0,0 +1,72 @@
+// Photos are shrunk in the browser and sent as binary JPEG files, so a slow
+// connection uploads a few hundred KB instead of the camera's original (or a
+// base64 data URL, a third larger again). The server shrinks anything bigger
+// than IMAGE_MAX_EDGE anyway, so nothing it would have kept is lost.
+
+const UPLOAD_MAX_EDGE = Number((document.currentScript && document.currentScript.dataset.maxEdge) || 1600);
+const UPLOAD_QUALITY = 0.85;
+
+// Draw `source` (a video, canvas or ImageBitmap) no larger than maxEdge and
+// encode it as JPEG. Resolves to a Blob.
+function encodeScaled(source, width, height, maxEdge) {
+    const scale = Math.min(1, (maxEdge || UPLOAD_MAX_EDGE) / Math.max(width, height));
+    const canvas = document.createElement('canvas');
+    canvas.width = Math.round(width * scale);
+    canvas.height = Math.round(height * scale);
+    canvas.getContext('2d').drawImage(source, 0, 0, canvas.width, canvas.height);
+    return new Promise(function (resolve, reject) {
+        canvas.toBlob(function (blob) {
+            blob ? resolve(blob) : reject(new Error('Could not encode the photo'));
+        }, 'image/jpeg', UPLOAD_QUALITY);
+    });
+}
+
+// Shrink a chosen file for upload. Falls back to the file itself when the
+// browser can't decode it (e.g. HEIC outside Safari) or shrinking wouldn't help.
+function shrinkImage(file, maxEdge) {
+    if (!window.createImageBitmap) return Promise.resolve(file);
+    return createImageBitmap(file, { imageOrientation: 'from-image' })
+        .then(function (bitmap) {
+            const fits = Math.max(bitmap.width, bitmap.height) <= (maxEdge || UPLOAD_MAX_EDGE);
+            if (fits && file.type === 'image/jpeg') {
+                bitmap.close();
+                return file;
+            }
+            return encodeScaled(bitmap, bitmap.width, bitmap.height, maxEdge)
+                .then(function (blob) {
+                    bitmap.close();
+                    return blob.size < file.size ? blob : file;
+                });
+        })
+        .catch(function () { return file; });
+}
+
+// Put a Blob into a file input so a plain form submit sends it as multipart.
+// Returns false on browsers that can't set input.files (no DataTransfer).
+function setInputFile(input, blob, name) {
+    try {
+        const transfer = new DataTransfer();
+        transfer.items.add(new File([blob], name, { type: blob.type || 'image/jpeg' }));
+        input.files = transfer.files;
+        return input.files.length === 1;
+    } catch (e) {
+        return false;
+    }
+}
+
+// Known products are answered from the catalogue by barcode, skipping the AI call.
+// `source` is a chosen File/Blob or anything drawable (video, canvas, ImageBitmap).
+// Resolves to '' where the browser has no BarcodeDetector or none is found.
+function detectBarcode(source) {
+    if (!('BarcodeDetector' in window)) return Promise.resolve('');
+    const detector = new BarcodeDetector({ formats: ['ean_13', 'ean_8', 'upc_a', 'upc_e'] });
+    const decoded = source instanceof Blob ? createImageBitmap(source) : Promise.resolve(source);
+    return decoded
+        .then(function (image) {
+            return detector.detect(image).finally(function () {
+                if (image !== source) image.close();
+            });
+        })
+        .then(function (codes) { return codes.length ? codes[0].rawValue : ''; })
+        .catch(function () { return ''; });
+}
@@ -0,0 +1,84 @@
+import pytest
+
+from additives import AdditiveMatcher, normalize_ingredients
+
+
+@pytest.fixture(scope='module')
+def matcher():
+    return AdditiveMatcher()
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('Preservative (E211)', 'preservative (e211)'),
+    ('Preservative (E-211)', 'preservative (e211)'),
+    ('Preservative (INS 211)', 'preservative (e211)'),
+    ('Preservative (ins.211)', 'preservative (e211)'),
+    ('Colours (102, 110)', 'colours (e102, e110)'),
+    ('Acidity regulator (330 & 331)', 'acidity regulator (e330 & e331)'),
+    ('Emulsifier (322i)', 'emulsifier (e322i)'),
+    ('Milk solids (26%)', 'milk solids (26%)'),
+    ('  Sugar,\n  SALT ', 'sugar, salt'),
+    ('MSG-free', 'msg free'),
+    ('Preservative (211) - free from colours', 'preservative (e211), free from colours'),
+    (None, ''),
+])
+def test_normalize_ingredients(text, expected):
+    assert normalize_ingredients(text) == expected
+
+
+@pytest.mark.parametrize('text, bad', [
+    ('Sugar, salt, sodium benzoate', ['Sodium Benzoate (E211)']),
+    ('Preservative (INS 211), colour (E-110)', ['Sodium Benzoate (E211)', 'Sunset Yellow FCF (E110)']),
+    ('Colours (102, 110)', ['Tartrazine (E102)', 'Sunset Yellow FCF (E110)']),
+    ('Flavour enhancer (621), MSG', ['MSG (E621)']),
+    ('Partially hydrogenated vegetable oil', ['Partially hydrogenated oil']),
+    ('Hydrogenated vegetable oil', ['Hydrogenated oil']),
+    ('Hydrogenated vegetable oils', ['Hydrogenated oil']),
+    ('Palm oil, hydrogenated fats', ['Hydrogenated oil']),
+    ('Onion bhaji mix, msgs', []),
+    ('', []),
+])
+def test_flags_additives_in_label_order(matcher, text, bad):
+    assert matcher.match(text) == (bad, [])
+
+
+@pytest.mark.parametrize('text', [
+    'No added MSG',
+    'Contains no added preservatives or MSG',
+    'MSG-free',
+    'MSG free',
+    'Without MSG',
+    'Free from MSG',
+    'Spices, MSG not added',
+    'Non-hydrogenated palm oil',
+])
+def test_claims_of_absence_are_not_flagged(matcher, text):
+    assert matcher.match(text) == ([], [])
+
+
+def test_negation_stops_at_the_clause(matcher):
+    bad, _ = matcher.match('No added colours, MSG; preservative (211)')
+    assert bad == ['MSG (E621)', 'Sodium Benzoate (E211)']
+    bad, _ = matcher.match('Non-hydrogenated palm oil, MSG')
+    assert bad == ['MSG (E621)']
+    bad, _ = matcher.match('Sugar free, sweetener (955)')
+    assert bad == ['Sucralose (E955)']
+    bad, _ = matcher.match('Preservative (211) - free from artificial colours')
+    assert bad == ['Sodium Benzoate (E211)']
+
+
+def test_trailing_negation_only_covers_the_word_before_it(matcher):
+    bad, _ = matcher.match('Sweetener (Sucralose) not added sugar')
+    assert bad == ['Sucralose (E955)']
+    bad, _ = matcher.match('MSG and sugar free')
+    assert bad == ['MSG (E621)']
+
+
+def test_fssai_flags_are_separate(matcher):
+    assert matcher.match('Wheat flour, potassium bromate, e211') == (
+        ['Sodium Benzoate (E211)'], ['Potassium Bromate (E924)'])
+
+
+def test_same_list_same_flags(matcher):
+    text = 'Maida, palmolein, salt, colour (E102, E110), preservative (211), MSG'
+    assert matcher.match(text) == matcher.match(text.upper())
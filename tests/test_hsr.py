@@ -0,0 +1,84 @@
+import pytest
+
+from hsr import score_batch, score_product
+
+
+def product(category='snack', **nutrients):
+    base = {'energy_kj': 500, 'sat_fat_g': 1, 'sugars_g': 1, 'sodium_mg': 90}
+    return {'category': category, 'nutrients': dict(base, **nutrients)}
+
+
+def test_low_baseline_scores_well():
+    scored = score_product(product(energy_kj=300, sat_fat_g=0.5, sugars_g=0.5, sodium_mg=50,
+                                   fibre_g=5, fvnl_pct=100, category='cereal'))
+    assert scored['rating'] == 5
+    assert scored['score_breakdown']['baseline'] == 0
+
+
+def test_high_energy_salty_snack_scores_badly():
+    scored = score_product(product(energy_kj=2250, sat_fat_g=12, sugars_g=2, sodium_mg=650))
+    assert scored['rating'] == 1
+    assert scored['score_breakdown']['energy_pts'] == 10
+
+
+@pytest.mark.parametrize('missing', ['energy_kj', 'sat_fat_g', 'sugars_g', 'sodium_mg'])
+def test_missing_baseline_nutrient_is_not_rated(missing):
+    scored = score_product(product(**{missing: None}))
+    assert scored['rating'] == 'N/A'
+    assert scored['score_breakdown'] == {}
+    assert scored['missing_nutrients'] == [missing]
+
+
+def test_only_sodium_readable_is_not_rated():
+    scored = score_product({'category': 'snack', 'nutrients': {'sodium_mg': 120}})
+    assert scored['rating'] == 'N/A'
+    assert scored['missing_nutrients'] == ['energy_kj', 'sat_fat_g', 'sugars_g']
+
+
+def test_missing_modifying_nutrients_only_forgo_credit():
+    scored = score_product(product(protein_g=None, fibre_g=None))
+    assert scored['score_breakdown']['modifying'] == 0
+
+
+def test_label_strings_are_parsed():
+    assert score_product(product(energy_kj='2,250 kJ', sodium_mg='650mg')) == \
+        score_product(product(energy_kj=2250, sodium_mg=650))
+
+
+def test_beverages_use_liquid_thresholds_and_no_protein_credit():
+    scored = score_product(product('beverage', energy_kj=180, sugars_g=10, sodium_mg=10, protein_g=3))
+    assert scored['score_breakdown']['protein_pts'] == 0
+    assert scored['score_breakdown']['sugar_pts'] == 5
+
+
+def test_snack_protein_needs_minimum():
+    assert score_product(product(protein_g=4))['score_breakdown']['protein_pts'] == 0
+    assert score_product(product(protein_g=8))['score_breakdown']['protein_pts'] > 0
+
+
+def test_dairy_calcium_bonus():
+    assert score_product(product('dairy', calcium_mg=120))['score_breakdown']['calcium_pts'] == 1
+    assert score_product(product('dairy', calcium_mg=80))['score_breakdown']['calcium_pts'] == 0
+
+
+def test_dairy_per_ml_uses_liquid_thresholds():
+    drink = score_product(product('dairy', sugars_g=10, basis='per 100 ml'))
+    food = score_product(product('dairy', sugars_g=10, basis='per 100 g'))
+    assert drink['score_breakdown']['sugar_pts'] > food['score_breakdown']['sugar_pts']
+
+
+def test_more_energy_never_rates_better():
+    ratings = [score_product(product(energy_kj=kj))['rating'] for kj in range(0, 4000, 100)]
+    assert ratings == sorted(ratings, reverse=True)
+
+
+def test_identical_inputs_get_identical_ratings():
+    label = product(energy_kj='1,480 kJ', sugars_g='12.5 g', protein_g=6)
+    scored = score_batch([label, product('beverage'), label, {'category': 'snack', 'nutrients': {}}])
+    assert scored[0] == scored[2] == score_product(label)
+
+
+def test_batch_matches_single_scoring():
+    products = [product(), product('beverage', sugars_g=6), {'category': 'snack', 'nutrients': {}}, product('dairy')]
+    assert score_batch(products) == [score_product(p) for p in products]
+    assert score_batch([]) == []
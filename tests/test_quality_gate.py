@@ -0,0 +1,38 @@
+import pytest
+
+from quality_gate import QualityGate
+
+
+def metrics(**overrides):
+    return dict({'sharpness': 200.0, 'brightness': 140.0, 'contrast': 50.0, 'min_edge': 1200}, **overrides)
+
+
+@pytest.fixture
+def gate():
+    return QualityGate()
+
+
+def test_good_photo_passes(gate):
+    assert gate.problems(metrics()) == []
+
+
+def test_white_panel_with_crisp_text_passes(gate):
+    assert gate.problems(metrics(brightness=245, contrast=56)) == []
+
+
+def test_washed_out_photo_is_bright(gate):
+    assert gate.problems(metrics(brightness=251, contrast=9, sharpness=110)) == ['bright']
+
+
+def test_bright_blurry_photo_reports_blur(gate):
+    assert gate.problems(metrics(brightness=245, contrast=40, sharpness=5)) == ['blurry']
+
+
+@pytest.mark.parametrize('overrides, expected', [
+    ({'brightness': 20, 'sharpness': 3}, ['dark']),
+    ({'sharpness': 5}, ['blurry']),
+    ({'contrast': 4}, ['low_contrast']),
+    ({'min_edge': 200}, ['small']),
+])
+def test_single_problem(gate, overrides, expected):
+    assert gate.problems(metrics(**overrides)) == expected
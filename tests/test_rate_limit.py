@@ -0,0 +1,81 @@
+import threading
+import time
+
+import pytest
+
+from rate_limit import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, AdmissionController, RateLimited
+
+
+@pytest.fixture
+def controller(tmp_path):
+    def make(**kwargs):
+        return AdmissionController(str(tmp_path / 'ratelimit.db'), **kwargs)
+    return make
+
+
+def wait_for_queue(limiter, depth, timeout=5):
+    deadline = time.time() + timeout
+    while limiter.stats()['queue_depth'] < depth:
+        assert time.time() < deadline, 'waiter never queued'
+        time.sleep(0.01)
+
+
+def test_burst_is_admitted_without_waiting(controller):
+    limiter = controller(rate=1, burst=3)
+    assert [limiter.acquire() < 0.1 for _ in range(3)] == [True] * 3
+    assert limiter.stats()['admitted'] == 3
+
+
+def test_wait_past_the_deadline_is_rejected_at_once(controller):
+    limiter = controller(rate=1, burst=1)
+    limiter.acquire()
+    start = time.time()
+    with pytest.raises(RateLimited) as exc:
+        limiter.acquire(max_wait=0.2)
+    assert time.time() - start < 0.2
+    assert exc.value.retry_after >= 1
+    assert limiter.stats()['rejected'] == 1
+
+
+def test_full_queue_is_rejected(controller):
+    limiter = controller(rate=2, burst=1, max_queue=1)
+    limiter.acquire()
+    waiter = threading.Thread(target=limiter.acquire, kwargs={'max_wait': 5})
+    waiter.start()
+    wait_for_queue(limiter, 1)
+    with pytest.raises(RateLimited, match='busy'):
+        limiter.acquire(max_wait=5)
+    waiter.join()
+    assert limiter.stats()['queue_depth'] == 0
+
+
+def test_interactive_is_served_before_background(controller):
+    limiter = controller(rate=2, burst=1)
+    limiter.acquire()
+    order = []
+
+    def take(priority):
+        limiter.acquire(priority, max_wait=5)
+        order.append(priority)
+
+    background = threading.Thread(target=take, args=(PRIORITY_BACKGROUND,))
+    background.start()
+    wait_for_queue(limiter, 1)
+    interactive = threading.Thread(target=take, args=(PRIORITY_INTERACTIVE,))
+    interactive.start()
+    background.join()
+    interactive.join()
+    assert order == [PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND]
+
+
+def test_workers_share_one_bucket(controller):
+    first, second = controller(rate=1, burst=2), controller(rate=1, burst=2)
+    first.acquire()
+    second.acquire()
+    with pytest.raises(RateLimited):
+        first.acquire(max_wait=0.1)
+
+
+def test_zero_rate_disables_limiting(controller):
+    limiter = controller(rate=0, burst=0)
+    assert limiter.acquire(max_wait=0) == 0.0
@@ -0,0 +1,111 @@
+import threading
+import time
+
+import pytest
+
+from resilience import CircuitBreaker, ModelTimeout, ResilientCaller, UpstreamUnavailable
+
+
+class Attempts:
+    """Callable attempt(timeout) that plays back `outcomes`: an exception is raised,
+    a number is slept for, anything else is returned."""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, timeout):
+        with self._lock:
+            outcome = self.outcomes[min(self.calls, len(self.outcomes) - 1)]
+            self.calls += 1
+        if isinstance(outcome, Exception):
+            raise outcome
+        if isinstance(outcome, float):
+            time.sleep(outcome)
+            return 'slow'
+        return outcome
+
+
+def test_breaker_trips_after_threshold_failures():
+    breaker = CircuitBreaker(threshold=2, reset_timeout=60)
+    breaker.record_failure()
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    with pytest.raises(UpstreamUnavailable) as exc:
+        breaker.before_call()
+    assert exc.value.retry_after >= 1
+    assert breaker.trips == 1
+
+
+def test_half_open_breaker_lets_one_trial_through_then_closes():
+    breaker = CircuitBreaker(threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.state == 'half_open'
+    breaker.before_call()
+    with pytest.raises(UpstreamUnavailable):
+        breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == 'closed'
+    breaker.before_call()
+
+
+def test_failed_trial_reopens_the_breaker():
+    breaker = CircuitBreaker(threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    assert breaker.trips == 2
+
+
+def test_retryable_errors_are_retried():
+    attempt = Attempts(ConnectionError('reset'), 'ok')
+    caller = ResilientCaller(deadline=5, retries=2, backoff=0.01)
+    assert caller.call(attempt) == 'ok'
+    assert attempt.calls == 2
+    assert caller.stats()['retried'] == 1
+
+
+def test_other_errors_are_not_retried():
+    attempt = Attempts(ValueError('bad request'), 'ok')
+    caller = ResilientCaller(deadline=5, retries=2, backoff=0.01)
+    with pytest.raises(ValueError):
+        caller.call(attempt)
+    assert attempt.calls == 1
+    assert caller.breaker.failures == 0
+
+
+def test_call_times_out_at_its_deadline_without_retrying():
+    attempt = Attempts(1.0)
+    caller = ResilientCaller(deadline=0.2, retries=2, backoff=0.01)
+    start = time.monotonic()
+    with pytest.raises(ModelTimeout):
+        caller.call(attempt)
+    assert time.monotonic() - start < 0.5
+    assert attempt.calls == 1
+    assert caller.stats()['retried'] == 0
+    assert caller.stats()['timeouts'] == 1
+
+
+def test_open_breaker_fails_fast_without_calling_upstream():
+    attempt = Attempts(ConnectionError('reset'))
+    caller = ResilientCaller(deadline=5, retries=0, breaker=CircuitBreaker(threshold=1, reset_timeout=60))
+    with pytest.raises(ConnectionError):
+        caller.call(attempt)
+    with pytest.raises(UpstreamUnavailable):
+        caller.call(attempt)
+    assert attempt.calls == 1
+
+
+def test_slow_call_is_hedged():
+    attempt = Attempts(1.0, 'fast')
+    caller = ResilientCaller(deadline=5, hedge=True, hedge_min_samples=1)
+    caller.latency.record(0.05)
+    start = time.monotonic()
+    assert caller.call(attempt) == 'fast'
+    assert time.monotonic() - start < 0.5
+    assert caller.stats()['hedged'] == 1
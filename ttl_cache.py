@@ -0,0 +1,160 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+# ── Keyed TTL cache with stale-while-revalidate ────────────────────────────────
+
+def normalize_key(*parts):
+    """Case- and whitespace-insensitive cache key from string parts."""
+    return '|'.join(' '.join(str(p).lower().split()) for p in parts)
+
+
+class TTLCache:
+    """Bounded LRU cache of JSON-serialisable values.
+
+    A value is fresh for `ttl` seconds. For a further `stale_ttl` seconds it is
+    still served, but the first caller to see it stale schedules a background
+    refresh. If `path` is set, entries are written through to a SQLite file and
+    reloaded on start, so the cache survives restarts. `on_lookup(name, result)`,
+    if given, is called after every lookup with 'hit', 'stale' or 'miss'.
+    """
+
+    def __init__(self, name, max_entries=2048, ttl=24 * 3600, stale_ttl=6 * 3600, path=None, on_lookup=None):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.path = path
+        self.on_lookup = on_lookup
+        self._entries = OrderedDict()   # key -> (stored_at, value)
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        if path:
+            self._load()
+
+    # ── Disk persistence ──
+
+    def _db(self):
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS cache ('
+            ' name TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, stored_at REAL NOT NULL,'
+            ' PRIMARY KEY (name, key))'
+        )
+        return conn
+
+    def _load(self):
+        oldest = time.time() - self.ttl - self.stale_ttl
+        conn = self._db()
+        try:
+            rows = conn.execute(
+                'SELECT key, value, stored_at FROM cache WHERE name = ? AND stored_at > ?'
+                ' ORDER BY stored_at DESC LIMIT ?',
+                (self.name, oldest, self.max_entries)
+            ).fetchall()
+            conn.execute('DELETE FROM cache WHERE name = ? AND stored_at <= ?', (self.name, oldest))
+        finally:
+            conn.close()
+        for key, value, stored_at in reversed(rows):
+            self._entries[key] = (stored_at, json.loads(value))
+
+    def _persist(self, key, stored_at, value):
+        try:
+            conn = self._db()
+            try:
+                conn.execute('INSERT OR REPLACE INTO cache (name, key, value, stored_at) VALUES (?, ?, ?, ?)',
+                             (self.name, key, json.dumps(value), stored_at))
+            finally:
+                conn.close()
+        except Exception as e:
+            print(f"Cache persist error ({self.name}): {e}")
+
+    # ── Lookups ──
+
+    def get(self, key):
+        """Return (value, is_stale), or (None, False) if missing or expired."""
+        value, result = self._lookup(key)
+        if self.on_lookup:
+            self.on_lookup(self.name, result)
+        return value, result == 'stale'
+
+    def _lookup(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None, 'miss'
+            age = now - entry[0]
+            if age > self.ttl + self.stale_ttl:
+                del self._entries[key]
+                self.misses += 1
+                return None, 'miss'
+            self._entries.move_to_end(key)
+            if age > self.ttl:
+                self.stale_hits += 1
+                return entry[1], 'stale'
+            self.hits += 1
+            return entry[1], 'hit'
+
+    def set(self, key, value):
+        stored_at = time.time()
+        with self._lock:
+            self._entries[key] = (stored_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        if self.path:
+            self._persist(key, stored_at, value)
+
+    def get_or_compute(self, key, compute, executor=None):
+        """Return the cached value, computing it on a miss.
+
+        `compute()` returning None (e.g. a failed upstream call) is not cached.
+        Stale values are returned immediately and refreshed on `executor` in the
+        background; without an executor they are recomputed inline.
+        """
+        if self.max_entries <= 0:
+            return compute()
+        value, stale = self.get(key)
+        if value is not None and not stale:
+            return value
+        if value is not None and executor is not None:
+            with self._lock:
+                if key in self._refreshing:
+                    return value
+                self._refreshing.add(key)
+            executor.submit(self._refresh, key, compute)
+            return value
+        try:
+            fresh = compute()
+        except Exception:
+            if value is None:
+                raise
+            fresh = None
+        if fresh is not None:
+            self.set(key, fresh)
+            return fresh
+        return value
+
+    def _refresh(self, key, compute):
+        try:
+            fresh = compute()
+            if fresh is not None:
+                self.set(key, fresh)
+        except Exception as e:
+            print(f"Cache refresh error ({self.name}): {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits,
+                    'stale_hits': self.stale_hits, 'misses': self.misses}